@@ -0,0 +1,67 @@
+#!/usr/bin/python3
+## Copyright 2015 Kevin Boxhoorn
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##   http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+## completion.py
+##
+## Benchmark of completing command names with 10,000 executables on PATH:
+## the first completion, which lists every directory, against later ones
+## served from the cached listings, and one after a directory changed.
+
+import os, shutil, sys, tempfile, time
+
+RUNS = 1000
+EXECUTABLES = 10000
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def main():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for i in range(EXECUTABLES):
+            path = os.path.join(tmpdir, "tool{0:05d}".format(i))
+            open(path, "w").close()
+            os.chmod(path, 0o755)
+        os.environ["PATH"] = tmpdir + os.pathsep + os.environ.get("PATH", "")
+
+        sys.path.insert(0, ROOT)
+        from pysh.completion import Completer
+        from pysh.core import Shell
+        completer = Completer(Shell())
+
+        start = time.perf_counter()
+        completer.completions("tool", "")
+        cold = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for _ in range(RUNS):
+            completer.completions("tool0999", "")
+        warm = (time.perf_counter() - start) / RUNS
+
+        ## a new mtime may fall in the same timestamp tick, so set one
+        path = os.path.join(tmpdir, "newtool")
+        open(path, "w").close()
+        os.chmod(path, 0o755)
+        os.utime(tmpdir, ns=(0, 0))
+        start = time.perf_counter()
+        completer.completions("newt", "")
+        changed = time.perf_counter() - start
+    finally:
+        shutil.rmtree(tmpdir)
+
+    print("first completion: {0:.1f} ms".format(cold * 1000))
+    print("cached completion: {0:.1f} µs".format(warm * 1e6))
+    print("after a directory changed: {0:.1f} ms".format(changed * 1000))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+#!/usr/bin/python3
+## Copyright 2015 Kevin Boxhoorn
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##   http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+## coreutils.py
+##
+## Benchmark of a loop of 10,000 "test" invocations, run by the in-process
+## builtin and by the external /usr/bin/test.
+
+import os, shutil, sys, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pysh.core import Shell
+
+RUNS = 10000
+
+def timeloop(shell, line):
+    cmd = shell.parse(line)
+    start = time.perf_counter()
+    for _ in range(RUNS):
+        status = shell.runcmd(cmd)
+    assert status == 0
+    return time.perf_counter() - start
+
+def main():
+    with open(os.devnull, "wb") as devnull:
+        shell = Shell(stdout=devnull)
+        builtin = timeloop(shell, "test -f /etc/passwd")
+        external = timeloop(shell, shutil.which("test") + " -f /etc/passwd")
+    print("builtin:  {0:.3f}s ({1:,.0f} tests/s)".format(builtin, RUNS / builtin))
+    print("external: {0:.3f}s ({1:,.0f} tests/s)".format(external, RUNS / external))
+    print("speedup:  {0:.0f}x".format(external / builtin))
+
+if __name__ == "__main__":
+    main()
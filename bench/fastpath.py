@@ -0,0 +1,104 @@
+#!/usr/bin/python3
+## Copyright 2015 Kevin Boxhoorn
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##   http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+## fastpath.py
+##
+## Differential check of the plain argv fast path against the full parser,
+## followed by a benchmark of lines parsed per second.
+
+import contextlib, io, os, random, sys, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pysh.parser import ParseCache, parseline, parser, plainline
+
+CORPUS = [
+    "",
+    "   ",
+    "ls",
+    "ls -la",
+    "ls -la /tmp",
+    "git status",
+    "git commit -m message",
+    "make -j8 all",
+    "cd ..",
+    "cd ../src",
+    "cd ./build/",
+    "cat /etc/hosts",
+    "rm -rf /tmp/a.b/c_d-e",
+    "python3 -m http.server",
+    "grep -rn TODO .",
+    "echo a+b c-d e_f",
+    "cp /a/b /c/d\t/e",
+    "tar xzf /tmp/pkg.tar.gz -C /opt\n",
+    "kill j1",
+    "job j12",
+    "export A=b",
+    "echo $HOME",
+    "ls ~/src",
+    "sleep 10 &",
+    "!!",
+    "!-2",
+    "!5",
+    "echo hi # comment",
+    "ls src/pysh",
+    "ls /a+b",
+    "echo a.txt",
+    "...",
+    ".../x",
+    "ls | wc -l",
+    "make > build.log 2>&1",
+    "sort < /tmp/in",
+]
+
+ALPHABET = "ab1-_+/. \t~$&!#=j|<>"
+
+def reference(line):
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = parser.parse(line)
+    return [] if result is None else result
+
+def check(lines):
+    fast = 0
+    for line in lines:
+        if not plainline.fullmatch(line):
+            continue
+        fast += 1
+        expected = reference(line)
+        if parseline(line) != expected:
+            raise AssertionError("{0!r}: fast path gave {1!r}, parser gave {2!r}".format(line, parseline(line), expected))
+    return fast
+
+def rate(func, lines, repeat=20):
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(repeat):
+            for line in lines:
+                func(line)
+    return len(lines) * repeat / (time.perf_counter() - start)
+
+def main():
+    rng = random.Random(0)
+    fuzz = ["".join(rng.choice(ALPHABET) for _ in range(rng.randrange(12))) for _ in range(20000)]
+    fast = check(CORPUS) + check(fuzz)
+    print("parity: {0} fast path lines match the parser".format(fast))
+
+    plain = [line for line in CORPUS if plainline.fullmatch(line)]
+    print("parser:    {0:,.0f} lines/s".format(rate(reference, plain)))
+    print("fast path: {0:,.0f} lines/s".format(rate(parseline, plain)))
+    print("cached:    {0:,.0f} lines/s".format(rate(ParseCache(len(plain)).parse, plain)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/python3
+## Copyright 2015 Kevin Boxhoorn
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##   http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+## history.py
+##
+## Benchmark of starting up with 1,000,000 history entries: reading a flat
+## readline history file against loading the recent window of the history
+## database, each in a fresh process, and of appending entries to the
+## database and searching it.
+
+import os, shutil, subprocess, sys, tempfile, time
+
+RUNS = 5
+ENTRIES = 1000000
+APPENDS = 1000
+SEARCHES = ("git", "status", "make target42", "ls /tmp", "-la", "scirpt12 pyhton", "nomatch")
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+LINES = ("ls -la /tmp/{0}", "cd ~/src/project{0}", "git status", "make -j8 target{0}",
+         "grep -r pattern{0} src", "python3 script{0}.py --verbose")
+
+def entries():
+    start = time.time() - ENTRIES
+    for i in range(ENTRIES):
+        yield LINES[i % len(LINES)].format(i % 49999), start + i, "/home/user/src", 0.01 * (i % 100), i % 3 == 0
+
+## time startup in a fresh process, printing seconds and peak rss in KiB
+def timeload(home, code):
+    wrapped = ("import resource, time; start = time.perf_counter(); {0}; "
+               "print(time.perf_counter() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)")
+    output = subprocess.check_output([sys.executable, "-c", wrapped.format(code)], cwd=ROOT, env=dict(os.environ, HOME=home))
+    seconds, rss = output.split()
+    return float(seconds), int(rss)
+
+def main():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        flat = os.path.join(tmpdir, "flat")
+        with open(flat, "w") as f:
+            for line, *_ in entries():
+                f.write(line + "\n")
+
+        sys.path.insert(0, ROOT)
+        os.environ["HOME"] = tmpdir
+        from pysh.history import HistoryStore
+        store = HistoryStore(os.path.join(tmpdir, "history.sqlite"))
+        store.extend(entries())
+
+        start = time.perf_counter()
+        for i in range(APPENDS):
+            store.add("echo {0}".format(i), time.time(), tmpdir, 0.001, 0)
+        append = (time.perf_counter() - start) / APPENDS
+
+        searches = {}
+        for query in SEARCHES:
+            runs = []
+            for _ in range(RUNS * 20):
+                start = time.perf_counter()
+                store.search(query)
+                runs.append(time.perf_counter() - start)
+            searches[query] = min(runs), sorted(runs)[len(runs) // 2]
+        store.close()
+
+        baseline = "import readline"
+        readfile = "import readline; readline.read_history_file({0!r})".format(flat)
+        loaddb = "from pysh.history import HistoryStore; HistoryStore({0!r}).load(1000)".format(os.path.join(tmpdir, "history.sqlite"))
+        results = {}
+        for name, code in (("interpreter", baseline), ("flat file", readfile), ("database", loaddb)):
+            runs = [timeload(tmpdir, code) for _ in range(RUNS)]
+            results[name] = min(seconds for seconds, _ in runs), min(rss for _, rss in runs)
+    finally:
+        shutil.rmtree(tmpdir)
+
+    for name, (seconds, rss) in results.items():
+        print("{0}: {1:.1f} ms, {2:.1f} MiB peak rss".format(name, seconds * 1000, rss / 1024))
+    print("append: {0:.1f} µs".format(append * 1e6))
+    for query, (best, median) in searches.items():
+        print("search {0!r}: {1:.3f} ms, median {2:.3f} ms".format(query, best * 1000, median * 1000))
+
+if __name__ == "__main__":
+    main()
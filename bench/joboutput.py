@@ -0,0 +1,56 @@
+#!/usr/bin/python3
+## Copyright 2015 Kevin Boxhoorn
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##   http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+## joboutput.py
+##
+## Benchmark of a background job writing a large output: the shell's memory
+## should stay bounded while the output is collected, and reading the tail
+## should not decompress the whole output.
+
+import os, resource, sys, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pysh.core import Shell
+
+LINES = 20000000
+
+def maxrss():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024
+
+def main():
+    with open(os.devnull, "wb") as devnull:
+        shell = Shell(stdout=devnull)
+        before = maxrss()
+        start = time.perf_counter()
+        shell.runcmd(shell.parse("seq {0} &".format(LINES)))
+        job = shell.jobs[0]
+        job.wait()
+        collected = time.perf_counter() - start
+        output = job.output
+        start = time.perf_counter()
+        shell.runcmd(shell.parse("job j1 tail 10"))
+        tail = time.perf_counter() - start
+        start = time.perf_counter()
+        shell.runcmd(shell.parse("job j1"))
+        full = time.perf_counter() - start
+        print("collected {0} MiB in {1:.2f}s ({2:.0f} MiB/s)".format(len(output) >> 20, collected, (len(output) >> 20) / collected))
+        print("{0} segments, {1} MiB on disk, {2} KiB in memory".format(len(output.segments), output.fileend >> 20, len(output.buffer) >> 10))
+        print("max rss {0} MiB before, {1} MiB after".format(before, maxrss()))
+        print("tail 10: {0:.2f}ms, whole output: {1:.2f}s".format(tail * 1000, full))
+        shell.end(0, exception=False)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+#!/usr/bin/python3
+## Copyright 2015 Kevin Boxhoorn
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##   http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+## jobs.py
+##
+## Benchmark of launching 1,000 background jobs and waiting for them all.
+
+import os, shutil, sys, threading, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pysh.core import Shell
+
+JOBS = 1000
+
+def main():
+    with open(os.devnull, "wb") as devnull:
+        shell = Shell(stdout=devnull)
+        ## the external sleep, as the builtin one would run on a thread
+        cmd = shutil.which("sleep") + " 0.5"
+        start = time.perf_counter()
+        for _ in range(JOBS):
+            shell.runcmd(shell.parse(cmd + " &"))
+        launched = time.perf_counter() - start
+        threads = threading.active_count()
+        shell.end(0, exception=False)
+        finished = time.perf_counter() - start
+    print("launched {0} jobs in {1:.2f}s ({2:.0f} jobs/s)".format(JOBS, launched, JOBS / launched))
+    print("all jobs reaped after {0:.2f}s".format(finished))
+    print("threads while running: {0}".format(threads))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+#!/usr/bin/python3
+## Copyright 2015 Kevin Boxhoorn
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##   http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+## jobscale.py
+##
+## Scalability benchmark of the job loop: starts many concurrent background
+## jobs (5,000 unless given as an argument), awaits them all from an asyncio
+## loop of its own and reports how long tracking them took. Every running job
+## holds two descriptors, a pidfd and its output pipe, so the descriptor
+## limit is raised to its hard limit first.
+
+import asyncio, os, resource, shutil, sys, threading, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pysh.core import Shell
+
+async def run(shell, count):
+    start = time.perf_counter()
+    cmd = shell.parse(shutil.which("sleep") + " 2")
+    jobs = [shell.startjob(cmd) for _ in range(count)]
+    launched = time.perf_counter() - start
+    threads = threading.active_count()
+    statuses = await asyncio.gather(*jobs)
+    finished = time.perf_counter() - start
+    assert statuses == [0] * count
+    print("launched {0} jobs in {1:.2f}s ({2:.0f} jobs/s)".format(count, launched, count / launched))
+    print("all jobs awaited after {0:.2f}s, {1:.2f}s after the last launch".format(finished, finished - launched))
+    print("threads while running: {0}".format(threads))
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    with open(os.devnull, "wb") as devnull:
+        shell = Shell(stdout=devnull)
+        asyncio.run(run(shell, count))
+        shell.end(0, exception=False)
+    print("max rss {0} MiB".format(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024))
+
+if __name__ == "__main__":
+    main()
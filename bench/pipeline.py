@@ -0,0 +1,53 @@
+#!/usr/bin/python3
+## Copyright 2015 Kevin Boxhoorn
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##   http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+## pipeline.py
+##
+## Benchmark of pipeline throughput in pysh against /bin/sh, with and
+## without enlarged pipe buffers ($PYSH_PIPESIZE).
+
+import os, subprocess, sys, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pysh.core import Shell
+
+SIZE = 1 << 30
+PIPELINE = "head -c {0} /dev/zero | cat | cat | wc -c".format(SIZE)
+
+def throughput(func):
+    start = time.perf_counter()
+    func()
+    return SIZE / (time.perf_counter() - start) / (1 << 20)
+
+def pysh(pipesize=None):
+    if pipesize:
+        os.environ["PYSH_PIPESIZE"] = str(pipesize)
+    else:
+        os.environ.pop("PYSH_PIPESIZE", None)
+    with open(os.devnull, "wb") as devnull:
+        shell = Shell(stdout=devnull)
+        shell.runcmd(shell.parse(PIPELINE))
+
+def sh():
+    subprocess.check_call(["/bin/sh", "-c", PIPELINE], stdout=subprocess.DEVNULL)
+
+def main():
+    print("/bin/sh:             {0:8.0f} MB/s".format(throughput(sh)))
+    print("pysh:                {0:8.0f} MB/s".format(throughput(pysh)))
+    print("pysh (1 MB buffers): {0:8.0f} MB/s".format(throughput(lambda: pysh(1 << 20))))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+#!/usr/bin/python3
+## Copyright 2015 Kevin Boxhoorn
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##   http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+## script.py
+##
+## Benchmark of running a 10,000 line script with a cold and a warm parsed
+## script cache, both end to end and for reading the script alone.
+
+import glob, os, shutil, subprocess, sys, tempfile, time
+
+RUNS = 5
+LINES = 10000
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def writescript(path):
+    with open(path, "w") as f:
+        for i in range(LINES):
+            f.write(("setenv PYSH_BENCH_{0} /tmp/{1}.txt\n", "cd ~/\n", "cd $HOME\n", "# comment {1}\n")[i % 4].format(i % 50, i))
+
+def timerun(env, path):
+    start = time.perf_counter()
+    subprocess.check_call([sys.executable, "main.py", path], cwd=ROOT, env=env,
+                          stderr=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+## time reading the script in a fresh process, so the parse cache is empty
+def timeread(env, path):
+    code = "import time; from pysh.script import readscript; start = time.perf_counter(); sum(1 for _ in readscript({0!r})); print(time.perf_counter() - start)"
+    return float(subprocess.check_output([sys.executable, "-c", code.format(path)], cwd=ROOT, env=env))
+
+def main():
+    tmpdir = tempfile.mkdtemp()
+    env = dict(os.environ, XDG_CACHE_HOME=tmpdir)
+    path = os.path.join(tmpdir, "bench.pysh")
+    writescript(path)
+    times = {"cold run": [], "warm run": [], "cold read": [], "warm read": []}
+    try:
+        for _ in range(RUNS):
+            for kind, timer in (("run", timerun), ("read", timeread)):
+                for cache in glob.glob(os.path.join(tmpdir, "pysh", "*.pyshc")):
+                    os.unlink(cache)
+                times["cold " + kind].append(timer(env, path))
+                times["warm " + kind].append(timer(env, path))
+    finally:
+        shutil.rmtree(tmpdir)
+    for name, results in times.items():
+        print("{0}: {1:.1f} ms".format(name, min(results) * 1000))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+#!/usr/bin/python3
+## Copyright 2015 Kevin Boxhoorn
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##   http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+## server.py
+##
+## Benchmark of "-c" invocations per second run directly through main.py
+## and through the warm server with pysh.client.
+
+import os, subprocess, sys, tempfile, time
+
+RUNS = 100
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def rate(argv, env):
+    start = time.perf_counter()
+    for _ in range(RUNS):
+        subprocess.check_call(argv, cwd=ROOT, env=env, stdout=subprocess.DEVNULL)
+    return RUNS / (time.perf_counter() - start)
+
+def main():
+    socketdir = tempfile.mkdtemp()
+    env = dict(os.environ, PYSH_SOCKET=os.path.join(socketdir, "pysh.sock"))
+    server = subprocess.Popen([sys.executable, "main.py", "--server"], cwd=ROOT, env=env)
+    try:
+        while not os.path.exists(env["PYSH_SOCKET"]):
+            time.sleep(0.01)
+        print("main.py:   {0:.1f} invocations/s".format(rate([sys.executable, "main.py", "-c", "true"], env)))
+        print("server:    {0:.1f} invocations/s".format(rate([sys.executable, "-S", "-m", "pysh.client", "-c", "true"], env)))
+    finally:
+        server.terminate()
+        server.wait()
+        os.rmdir(socketdir)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+#!/usr/bin/python3
+## Copyright 2015 Kevin Boxhoorn
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##   http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+## spawn.py
+##
+## Benchmark of process launch latency against the shell's resident set
+## size, comparing fork+exec, subprocess and the posix_spawn backend.
+## Usage: bench/spawn.py [MB ...]
+
+import os, resource, subprocess, sys, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pysh.spawn import spawn, wait
+
+RUNS = 200
+TRUE = "/bin/true"
+
+def forkexec():
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.execv(TRUE, [TRUE])
+        finally:
+            os._exit(127)
+    os.waitpid(pid, 0)
+
+def latency(func):
+    start = time.perf_counter()
+    for _ in range(RUNS):
+        func()
+    return (time.perf_counter() - start) / RUNS * 1e6
+
+def main():
+    sizes = [int(x) for x in sys.argv[1:]] or [0, 64, 256]
+    ballast = []
+    print("{0:>8} {1:>12} {2:>12} {3:>12}".format("RSS MB", "fork+exec", "subprocess", "posix_spawn"))
+    for size in sizes:
+        ## touch every page so the memory is resident
+        ballast.append(bytearray(b"\1") * (size << 20))
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss >> 10
+        print("{0:8} {1:10.0f}us {2:10.0f}us {3:10.0f}us".format(
+            rss, latency(forkexec), latency(lambda: subprocess.call([TRUE])),
+            latency(lambda: wait(spawn([TRUE])))))
+
+if __name__ == "__main__":
+    main()
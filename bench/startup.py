@@ -0,0 +1,47 @@
+#!/usr/bin/python3
+## Copyright 2015 Kevin Boxhoorn
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##   http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+## startup.py
+##
+## Benchmark of shell startup with a cold and a warm parse table cache.
+
+import os, shutil, subprocess, sys, tempfile, time
+
+RUNS = 20
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def timeimport(env):
+    start = time.perf_counter()
+    subprocess.check_call([sys.executable, "-c", "import pysh.parser"], cwd=ROOT, env=env,
+                          stderr=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+def main():
+    cachehome = tempfile.mkdtemp()
+    env = dict(os.environ, XDG_CACHE_HOME=cachehome)
+    cold = []
+    warm = []
+    try:
+        for _ in range(RUNS):
+            shutil.rmtree(os.path.join(cachehome, "pysh"), ignore_errors=True)
+            cold.append(timeimport(env))
+            warm.append(timeimport(env))
+    finally:
+        shutil.rmtree(cachehome)
+    print("cold: {0:.1f} ms".format(min(cold) * 1000))
+    print("warm: {0:.1f} ms".format(min(warm) * 1000))
+
+if __name__ == "__main__":
+    main()
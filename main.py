@@ -17,24 +17,55 @@
 ##
 ## PySH entry point.
 
-import getpass, locale, platform, sys
+import getpass, locale, os, platform, sys, time
 from argparse import ArgumentParser
 from os import getcwd
 
 from pysh.builtins import *
-from pysh.core import Command, Shell, shrinkuser
+from pysh.core import HISTORY_PICK, Command, Shell, shrinkuser
 
 locale.setlocale(locale.LC_ALL, "")
 
 argparser = ArgumentParser(description="a shell made in Python, prioritizing speed and efficiency.")
+argparser.add_argument("script", nargs="?", help="file of commands to run in the shell")
 argparser.add_argument("-c", help="command to run in the shell")
+argparser.add_argument("--trace", metavar="FILE", help="write chrome trace events for each command to FILE")
+argparser.add_argument("--metrics", metavar="SOCKET", help="serve prometheus metrics on a unix socket")
+argparser.add_argument("--server", action="store_true", help="serve -c invocations from pysh.client on a unix socket")
 args = argparser.parse_args()
 
+if args.trace:
+    from pysh.trace import tracer
+    tracer.start(args.trace)
+
+if args.metrics:
+    from pysh.metrics import metrics
+    metrics.serve(args.metrics)
+
+## keep a warm process serving -c invocations
+if args.server:
+    from pysh.server import serve
+    serve(PYSH_SOCKET)
 ## if command argument exists run it
-if args.c:
+elif args.c:
     shell = Shell()
-    shell.runcmd(parser.parse(args.c).split())
-    shell.end(0)
+    try:
+        shell.runcmd(shell.parse(args.c))
+        shell.end(0, exception=False)
+    except ShellEndedError:
+        pass
+    except Exception as e:
+        shell.print(str(e) + "\n")
+    sys.exit(shell.status)
+## run a script, up to its end or an "exit"
+elif args.script:
+    shell = Shell()
+    try:
+        shell.runscript(args.script)
+        shell.end(0)
+    except ShellEndedError:
+        pass
+    sys.exit(shell.status)
 ## else start interactive shell
 else:
     shell = Shell()
@@ -45,15 +76,26 @@ else:
     else:
         usersym = "$"
 
-    ## initialize readline module
+    ## initialize readline module with the most recent history
     import readline
-    open(PYSH_HISTFILE, "a").close()
-    readline.read_history_file(PYSH_HISTFILE)
-    readline.parse_and_bind("tab: complete")
+    from pysh.completion import Completer
+    from pysh.history import HistoryStore
+    shell.history = HistoryStore(PYSH_HISTDB)
+    try:
+        histsize = int(os.environ.get("PYSH_HISTSIZE", PYSH_HISTSIZE))
+    except ValueError:
+        histsize = PYSH_HISTSIZE
+    shell.history.load(histsize)
+    shell.history.startmerging(PYSH_HISTMERGE_INTERVAL)
+    Completer(shell).install()
+    ## Ctrl-R searches every session's history for the text typed so far
+    readline.parse_and_bind(r'"\C-r": "\C-a' + HISTORY_PICK + r'\C-j"')
 
     ## main loop
     while True:
         cwd = shrinkuser(getcwd())
+        shell.notifyjobs()
+        shell.history.merge()
 
         try:
             cmd = shell.input("{0}({1}){3}:{2}/ ".format(user, platid, cwd, usersym))
@@ -64,13 +106,23 @@ else:
         except KeyboardInterrupt:
             shell.newline()
             continue
+        ## e.g. a history event that is not found; the line is not run
+        except Exception as e:
+            shell.print(str(e) + "\n")
+            continue
 
-        ## run command
+        ## run command, then append it to the history with how it went
+        start, where = time.time(), getcwd()
         try:
             shell.runcmd(cmd)
         except ShellEndedError:
             break
+        except KeyboardInterrupt:
+            shell.newline()
         except Exception as e:
             shell.print(str(e) + "\n")
+        finally:
+            if shell.line.strip():
+                shell.history.add(shell.line, start, where, time.time() - start, shell.status)
 
-    readline.write_history_file(PYSH_HISTFILE)
+    shell.history.close()
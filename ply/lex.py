@@ -39,7 +39,6 @@ import sys
 import types
 import copy
 import os
-import inspect
 
 # This tuple contains known string types
 try:
@@ -173,7 +172,10 @@ class Lexer:
     # ------------------------------------------------------------
     def writetab(self, basetabmodule, outputdir=''):
         filename = os.path.join(outputdir, basetabmodule) + '.py'
-        with open(filename, 'w') as tf:
+        # Write to a temporary file first so that concurrent readers never
+        # see a partially written table
+        tmpname = '%s.%d.tmp' % (filename, os.getpid())
+        with open(tmpname, 'w') as tf:
             tf.write('# %s.py. This file automatically created by PLY (version %s). Don\'t edit!\n' % (basetabmodule, __version__))
             tf.write('_tabversion   = %s\n' % repr(__tabversion__))
             tf.write('_lextokens    = %s\n' % repr(self.lextokens))
@@ -201,6 +203,7 @@ class Lexer:
             for statename, ef in self.lexstateeoff.items():
                 tabeof[statename] = ef.__name__ if ef else None
             tf.write('_lexstateeoff = %s\n' % repr(tabeof))
+        os.rename(tmpname, filename)
 
     # ------------------------------------------------------------
     # readtab() - Read lexer information from a tab file
@@ -724,6 +727,7 @@ class LexerReflect(object):
 
     # Validate all of the t_rules collected
     def validate_rules(self):
+        import inspect
         for state in self.stateinfo:
             # Validate all rules defined by functions
 
@@ -827,6 +831,7 @@ class LexerReflect(object):
     # -----------------------------------------------------------------------------
 
     def validate_module(self, module):
+        import inspect
         lines, linen = inspect.getsourcelines(module)
 
         fre = re.compile(r'\s*def\s+(t_[a-zA-Z_0-9]*)\(')
@@ -885,12 +890,19 @@ def lex(module=None, object=None, debug=False, optimize=False, lextab='lextab',
     else:
         ldict = get_caller_module_dict(2)
 
+    # A previously loaded table module may be passed instead of a module name
+    if isinstance(lextab, types.ModuleType):
+        lextabmodule = lextab
+        lextab = lextab.__name__
+    else:
+        lextabmodule = None
+
     if outputdir is None:
         # If no output directory is set, the location of the output files
         # is determined according to the following rules:
         #     - If lextab specifies a package, files go into that package directory
         #     - Otherwise, files go in the same directory as the specifying module
-        if '.' not in lextab:
+        if lextabmodule or '.' not in lextab:
             srcfile = ldict['__file__']
         else:
             parts = lextab.split('.')
@@ -902,22 +914,17 @@ def lex(module=None, object=None, debug=False, optimize=False, lextab='lextab',
     # Determine if the module is package of a package or not.
     # If so, fix the tabmodule setting so that tables load correctly
     pkg = ldict.get('__package__')
-    if pkg:
+    if pkg and not lextabmodule:
         if '.' not in lextab:
             lextab = pkg + '.' + lextab
 
     baselextab = lextab.split('.')[-1]
 
-    # Collect parser information from the dictionary
-    linfo = LexerReflect(ldict, log=errorlog, reflags=reflags)
-    linfo.get_all()
-    if not optimize:
-        if linfo.validate_all():
-            raise SyntaxError("Can't build lexer")
-
+    # In optimize mode a table that was validated and written by a previous
+    # run is trusted, so no rules are collected from the module at all
     if optimize and lextab:
         try:
-            lexobj.readtab(lextab, ldict)
+            lexobj.readtab(lextabmodule or lextab, ldict)
             token = lexobj.token
             input = lexobj.input
             lexer = lexobj
@@ -925,6 +932,16 @@ def lex(module=None, object=None, debug=False, optimize=False, lextab='lextab',
 
         except ImportError:
             pass
+        except Exception as e:
+            errorlog.warning('There was a problem loading the table file: %r', e)
+
+    # Collect parser information from the dictionary.  The rules are always
+    # validated here, including in optimize mode, where the table written
+    # below is trusted from then on
+    linfo = LexerReflect(ldict, log=errorlog, reflags=reflags)
+    linfo.get_all()
+    if linfo.validate_all():
+        raise SyntaxError("Can't build lexer")
 
     # Dump some basic debugging information
     if debug:
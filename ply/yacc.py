@@ -63,7 +63,6 @@ import re
 import types
 import sys
 import os.path
-import inspect
 import base64
 import warnings
 
@@ -2815,7 +2814,10 @@ del _lr_goto_items
             import cPickle as pickle
         except ImportError:
             import pickle
-        with open(filename, 'wb') as outf:
+        # Write to a temporary file first so that concurrent readers never
+        # see a partially written table
+        tmpname = '%s.%d.tmp' % (filename, os.getpid())
+        with open(tmpname, 'wb') as outf:
             pickle.dump(__tabversion__, outf, pickle_protocol)
             pickle.dump(self.lr_method, outf, pickle_protocol)
             pickle.dump(signature, outf, pickle_protocol)
@@ -2829,6 +2831,7 @@ del _lr_goto_items
                 else:
                     outp.append((str(p), p.name, p.len, None, None, None))
             pickle.dump(outp, outf, pickle_protocol)
+        os.rename(tmpname, filename)
 
 # -----------------------------------------------------------------------------
 #                            === INTROSPECTION ===
@@ -2852,6 +2855,20 @@ def get_caller_module_dict(levels):
         ldict.update(f.f_locals)
     return ldict
 
+# -----------------------------------------------------------------------------
+# get_function_module()
+#
+# Returns the module in which a function was defined.  The lookup through
+# sys.modules avoids importing inspect, which is only needed for validation.
+# -----------------------------------------------------------------------------
+
+def get_function_module(func):
+    module = sys.modules.get(func.__module__)
+    if module is None:
+        import inspect
+        module = inspect.getmodule(func)
+    return module
+
 # -----------------------------------------------------------------------------
 # parse_grammar()
 #
@@ -2968,6 +2985,8 @@ class ParserReflect(object):
     # -----------------------------------------------------------------------------
 
     def validate_modules(self):
+        import inspect
+
         # Match def p_funcname(
         fre = re.compile(r'\s*def\s+(p_[a-zA-Z_0-9]*)\(')
 
@@ -3016,7 +3035,7 @@ class ParserReflect(object):
 
             eline = self.error_func.__code__.co_firstlineno
             efile = self.error_func.__code__.co_filename
-            module = inspect.getmodule(self.error_func)
+            module = get_function_module(self.error_func)
             self.modules.add(module)
 
             argcount = self.error_func.__code__.co_argcount - ismethod
@@ -3101,7 +3120,7 @@ class ParserReflect(object):
                 continue
             if isinstance(item, (types.FunctionType, types.MethodType)):
                 line = item.__code__.co_firstlineno
-                module = inspect.getmodule(item)
+                module = get_function_module(item)
                 p_functions.append((line, module, name, item.__doc__))
 
         # Sort all of the actions by line number
@@ -3118,8 +3137,8 @@ class ParserReflect(object):
             return
 
         for line, module, name, doc in self.pfuncs:
-            file = inspect.getsourcefile(module)
             func = self.pdict[name]
+            file = func.__code__.co_filename
             if isinstance(func, types.MethodType):
                 reqargs = 2
             else:
@@ -3252,8 +3271,10 @@ def yacc(method='LALR', debug=yaccdebug, module=None, tabmodule=tab_module, star
                 errorlog.warning('There was a problem loading the table file: %r', e)
     except VersionError as e:
         errorlog.warning(str(e))
-    except ImportError:
+    except (ImportError, IOError):
         pass
+    except Exception as e:
+        errorlog.warning('There was a problem loading the table file: %r', e)
 
     if debuglog is None:
         if debug:
@@ -3269,7 +3290,9 @@ def yacc(method='LALR', debug=yaccdebug, module=None, tabmodule=tab_module, star
 
     errors = False
 
-    # Validate the parser information
+    # Validate the parser information.  This happens whenever tables are
+    # generated, including in optimize mode, where they are trusted once
+    # written
     if pinfo.validate_all():
         raise YaccError('Unable to build parser')
 
@@ -17,9 +17,55 @@
 ##
 ## Global objects and variables, including custom exceptions.
 
-from os.path import expanduser
+from os import environ, getpid, getuid
+from os.path import expanduser, isabs, join
 
+## flat history file of older versions, imported into the history database
 PYSH_HISTFILE = expanduser("~/.pysh-history")
+PYSH_HISTDB = expanduser("~/.pysh-history.sqlite")
+## entries of the history database loaded into readline at startup, unless
+## $PYSH_HISTSIZE is set
+PYSH_HISTSIZE = 1000
+## matches "history search" shows by default
+PYSH_HISTSEARCH_SIZE = 20
+## seconds between looks for commands other sessions added to the history
+PYSH_HISTMERGE_INTERVAL = 1.0
+PYSH_PARSECACHE_SIZE = 512
+## bytes of a background job's output kept in memory, unless $PYSH_JOBBUFFER is
+## set; older output is compressed into a temporary file
+PYSH_JOBBUFFER_SIZE = 1 << 20
+
+## generated files (parse tables etc.) live here rather than in the working directory
+if isabs(environ.get("XDG_CACHE_HOME", "")):
+    PYSH_CACHEDIR = join(environ["XDG_CACHE_HOME"], "pysh")
+else:
+    PYSH_CACHEDIR = expanduser("~/.cache/pysh")
+
+## python files in this directory are plugins, each providing the builtin
+## named after the file
+if "PYSH_PLUGINDIR" in environ:
+    PYSH_PLUGINDIR = environ["PYSH_PLUGINDIR"]
+elif isabs(environ.get("XDG_CONFIG_HOME", "")):
+    PYSH_PLUGINDIR = join(environ["XDG_CONFIG_HOME"], "pysh", "plugins")
+else:
+    PYSH_PLUGINDIR = expanduser("~/.config/pysh/plugins")
+
+## unix socket of the warm server started with "main.py --server"
+if "PYSH_SOCKET" in environ:
+    PYSH_SOCKET = environ["PYSH_SOCKET"]
+elif isabs(environ.get("XDG_RUNTIME_DIR", "")):
+    PYSH_SOCKET = join(environ["XDG_RUNTIME_DIR"], "pysh.sock")
+else:
+    PYSH_SOCKET = join(environ.get("TMPDIR", "/tmp"), "pysh-{0}.sock".format(getuid()))
+
+## unix socket "stats serve" serves metrics on by default, one for each
+## shell process
+if "PYSH_METRICS_SOCKET" in environ:
+    PYSH_METRICS_SOCKET = environ["PYSH_METRICS_SOCKET"]
+elif isabs(environ.get("XDG_RUNTIME_DIR", "")):
+    PYSH_METRICS_SOCKET = join(environ["XDG_RUNTIME_DIR"], "pysh-metrics-{0}.sock".format(getpid()))
+else:
+    PYSH_METRICS_SOCKET = join(environ.get("TMPDIR", "/tmp"), "pysh-metrics-{0}-{1}.sock".format(getuid(), getpid()))
 
 class ArgumentError(Exception):
     def __init__(self, message, argnum):
@@ -32,6 +78,16 @@ class ArgumentCountError(Exception):
         self.expargcount = expargcount
         super().__init__("ArgumentCountError: expected {0} arguments but found {1}".format(self.expargcount, self.argcount))
 
+## a history expansion that refers to no command, or to words it lacks
+class HistoryEventError(LookupError):
+    def __init__(self, event, reason):
+        super().__init__("{0}: {1}".format(event, reason))
+
+## a command that is neither a builtin nor found on PATH (exit status 127)
+class CommandNotFoundError(FileNotFoundError):
+    def __init__(self, name):
+        super().__init__("{0}: command not found".format(name))
+
 class ShellEndedError(Exception):
     def __init__(self, status):
         self.status = status
@@ -0,0 +1,52 @@
+#!/usr/bin/python3
+## Copyright 2015 Kevin Boxhoorn
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##   http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+## cache.py
+##
+## Persistent caches stored in the user's cache directory.
+
+from importlib.util import module_from_spec, spec_from_file_location
+from os import makedirs, remove
+from os.path import exists, join
+
+from pysh.builtins import PYSH_CACHEDIR
+
+## returns the path of a file in the cache directory, or None if the
+## directory cannot be created (e.g. read-only home directory)
+def cachefile(name):
+    try:
+        makedirs(PYSH_CACHEDIR, exist_ok=True)
+    except OSError:
+        return None
+    return join(PYSH_CACHEDIR, name)
+
+## imports a python module written to the cache directory (e.g. a lexer
+## table), returning None if it has not been generated yet or cannot be
+## loaded, in which case it is removed to be generated again
+def cachemodule(name):
+    path = join(PYSH_CACHEDIR, name + ".py")
+    if not exists(path):
+        return None
+    spec = spec_from_file_location(name, path)
+    module = module_from_spec(spec)
+    try:
+        spec.loader.exec_module(module)
+    except Exception:
+        try:
+            remove(path)
+        except OSError:
+            pass
+        return None
+    return module
@@ -0,0 +1,100 @@
+#!/usr/bin/python3
+## Copyright 2015 Kevin Boxhoorn
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##   http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+## client.py
+##
+## Client for the warm server (see server.py), run as "python3 -S -m pysh.client
+## -c COMMAND". It only imports what it needs to forward its arguments,
+## environment, working directory and stdio, and falls back to running
+## main.py directly when no server is listening.
+
+import os, signal, socket, struct, sys
+
+from pysh.builtins import PYSH_SOCKET
+
+def encoderequest(argv):
+    fields = [os.getcwd(), str(len(argv))] + argv
+    fields.extend("{0}={1}".format(var, val) for var, val in os.environ.items())
+    return "\0".join(fields).encode("utf-8", "surrogateescape")
+
+## the server replies with tagged messages: the pid of the child running
+## the command, so that interrupts can be forwarded to it, and then its exit
+## status. If the child fails before it starts, only the status is sent
+MESSAGE_PID = b"P"
+MESSAGE_STATUS = b"S"
+
+## reads a message, returning its tag and value, or None at end of file
+def recvmessage(conn):
+    data = b""
+    while len(data) < 5:
+        chunk = conn.recv(5 - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data[:1], struct.unpack("!i", data[1:])[0]
+
+## whether pid is a child of the process parent, from /proc
+def childof(pid, parent):
+    try:
+        with open("/proc/{0}/stat".format(pid), "rb") as f:
+            stat = f.read()
+    except OSError:
+        return False
+    ## the command name in parentheses may hold spaces, so the fields are
+    ## counted from its closing parenthesis
+    return int(stat[stat.rindex(b")") + 2:].split()[1]) == parent
+
+def main(argv):
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.connect(PYSH_SOCKET)
+    except OSError:
+        conn.close()
+        mainpy = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "main.py")
+        os.execv(sys.executable, [sys.executable, mainpy] + argv)
+
+    data = encoderequest(argv)
+    socket.send_fds(conn, [struct.pack("!I", len(data))], [0, 1, 2])
+    conn.sendall(data)
+
+    ## only a pid sent by a child of the server is ever signalled
+    server = struct.unpack("3i", conn.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i")))[0]
+    pid = None
+    status = None
+    interrupted = False
+    while status is None:
+        try:
+            message = recvmessage(conn)
+            if message is None:
+                break
+            tag, value = message
+            if tag == MESSAGE_STATUS:
+                status = value
+            elif tag == MESSAGE_PID and value > 1 and childof(value, server):
+                pid = value
+        except KeyboardInterrupt:
+            if pid is None:
+                conn.close()
+                return 130
+            os.kill(pid, signal.SIGINT)
+            interrupted = True
+    conn.close()
+    ## a child killed by the forwarded interrupt never sends its status
+    if status is None:
+        return 128 + signal.SIGINT if interrupted else 1
+    return status
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,136 @@
+#!/usr/bin/python3
+## Copyright 2015 Kevin Boxhoorn
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##   http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+## cmdhash.py
+##
+## Hash table of executable paths, in the style of bash's "hash" builtin.
+
+from os import access, environ, scandir, stat, X_OK
+from os.path import isfile, join
+
+## maps command names to the absolute path they resolve to on PATH; the
+## table is emptied whenever PATH or the modification time of one of its
+## directories changes, since either may change what a name resolves to
+class CommandHash:
+    def __init__(self):
+        self.path = None
+        self.dirs = []
+        self.mtimes = []
+        self.table = {}
+        self.hits = 0
+        self.misses = 0
+        ## directory -> (mtime, executable names), for completion
+        self.listings = {}
+        ## sorted names of every executable on PATH, and the PATH and mtimes
+        ## they were listed with
+        self.names = []
+        self.nameskey = None
+
+    def __len__(self):
+        return len(self.table)
+
+    def __iter__(self):
+        return iter(self.table.items())
+
+    ## forget all remembered locations
+    def clear(self):
+        self.path = None
+        self.table.clear()
+
+    def dirmtimes(self):
+        mtimes = []
+        for directory in self.dirs:
+            try:
+                mtimes.append(stat(directory).st_mtime_ns)
+            except OSError:
+                mtimes.append(None)
+        return mtimes
+
+    def validate(self):
+        path = environ.get("PATH", "")
+        if path != self.path:
+            self.path = path
+            self.dirs = [directory or "." for directory in path.split(":")]
+            self.mtimes = self.dirmtimes()
+            self.table.clear()
+            return
+        mtimes = self.dirmtimes()
+        if mtimes != self.mtimes:
+            self.mtimes = mtimes
+            self.table.clear()
+
+    ## the executable names of a directory, listed again only when its
+    ## modification time has changed
+    def listing(self, directory, mtime):
+        listing = self.listings.get(directory)
+        if listing is not None and listing[0] == mtime:
+            return listing[1]
+        names = []
+        try:
+            with scandir(directory) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_file() and access(entry.path, X_OK):
+                            names.append(entry.name)
+                    except OSError:
+                        pass
+        except OSError:
+            pass
+        self.listings[directory] = (mtime, names)
+        return names
+
+    ## sorted names of every executable on PATH
+    def executables(self):
+        self.validate()
+        key = (self.path, self.mtimes)
+        if key != self.nameskey:
+            names = set()
+            for directory, mtime in zip(self.dirs, self.mtimes):
+                names.update(self.listing(directory, mtime))
+            self.names = sorted(names)
+            self.nameskey = key
+        return self.names
+
+    ## search PATH for an executable, without using the table
+    def search(self, name):
+        for directory in self.dirs:
+            path = join(directory, name)
+            if isfile(path) and access(path, X_OK):
+                return path
+        return None
+
+    ## returns the absolute path of a command, or None if it is not on PATH
+    def lookup(self, name):
+        if "/" in name:
+            return name
+        self.validate()
+        entry = self.table.get(name)
+        if entry is not None:
+            entry[1] += 1
+            self.hits += 1
+            return entry[0]
+        self.misses += 1
+        path = self.search(name)
+        if path is not None:
+            self.table[name] = [path, 1]
+        return path
+
+    ## remember path as the location of name without searching PATH, as
+    ## "hash -p" does; it is forgotten like any other entry
+    def remember(self, name, path):
+        self.validate()
+        self.table[name] = [path, 0]
+
+cmdhash = CommandHash()
@@ -0,0 +1,99 @@
+#!/usr/bin/python3
+## Copyright 2015 Kevin Boxhoorn
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##   http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+## completion.py
+##
+## Tab completion for readline: builtins and executables on PATH in command
+## position, "jN" job identifiers, "$VARS" and file names. Executables come
+## from the listings cached by cmdhash, which only lists a directory again
+## when its modification time changes, so completing stays instant however
+## many commands PATH holds.
+
+import os, readline
+from bisect import bisect_left
+
+from pysh.cmdhash import cmdhash
+from pysh.registry import registry
+
+## only the characters that separate commands and words end a completed
+## word, so "$", "/", "-" and "." are part of it
+COMPLETER_DELIMS = " \t\n|&<>"
+
+## the items of a sorted list starting with prefix
+def startingwith(items, prefix):
+    matches = []
+    for i in range(bisect_left(items, prefix), len(items)):
+        if not items[i].startswith(prefix):
+            break
+        matches.append(items[i])
+    return matches
+
+class Completer:
+    def __init__(self, shell):
+        self.shell = shell
+        self.matches = []
+
+    ## readline's completer: the state'th completion of text
+    def complete(self, text, state):
+        if state == 0:
+            try:
+                self.matches = self.completions(text, readline.get_line_buffer()[:readline.get_begidx()])
+            except Exception:
+                self.matches = []
+        if state < len(self.matches):
+            return self.matches[state]
+        return None
+
+    ## the completions of text, after the line up to it
+    def completions(self, text, before):
+        if text.startswith("$"):
+            return ["$" + name for name in sorted(os.environ) if name.startswith(text[1:])]
+        words = before.split()
+        ## a command starts the line or follows "|" or "&", except the "&"
+        ## of a ">&" duplication, which is followed by a file descriptor
+        last = before.rstrip()
+        if (not words or last.endswith("|") or (last.endswith("&") and not last.endswith(">&"))) and "/" not in text:
+            return self.commands(text)
+        matches = []
+        if text[:1] == "j" and (text == "j" or text[1:].isdigit()):
+            matches = ["j{0}".format(i + 1) for i in range(len(self.shell.jobs)) if "j{0}".format(i + 1).startswith(text)]
+        return matches + self.files(text)
+
+    def commands(self, text):
+        builtins = sorted(name for name in registry.names() if name.startswith(text))
+        return builtins + [name for name in startingwith(cmdhash.executables(), text) if name not in builtins]
+
+    ## file names starting with text, with a "/" after directories
+    def files(self, text):
+        directory, prefix = os.path.split(text)
+        matches = []
+        try:
+            with os.scandir(os.path.expanduser(directory) or ".") as entries:
+                for entry in entries:
+                    if entry.name.startswith(prefix) and (prefix or not entry.name.startswith(".")):
+                        try:
+                            isdir = entry.is_dir()
+                        except OSError:
+                            isdir = False
+                        matches.append(os.path.join(directory, entry.name) + ("/" if isdir else ""))
+        except OSError:
+            pass
+        return sorted(matches)
+
+    ## make this readline's completer
+    def install(self):
+        readline.set_completer(self.complete)
+        readline.set_completer_delims(COMPLETER_DELIMS)
+        readline.parse_and_bind("tab: complete")
@@ -17,14 +17,50 @@
 ##
 ## Core functions of the shell.
 
-import os, random, readline, signal, string, subprocess, sys
+import fcntl, os, readline, resource, signal, sys, time
+from functools import partial
 from os import chdir, environ
 from os.path import exists, isdir
-from tempfile import TemporaryFile
-from threading import Thread
 
 from pysh.builtins import *
-from pysh.parser import parser
+from pysh.cmdhash import cmdhash
+from pysh.histindex import histindex
+from pysh.jobs import Job
+from pysh.metrics import metrics
+from pysh.parallel import Parallel
+from pysh.parser import Background, Pipe, Redirect, Word, parse, parsecache
+from pysh.registry import builtin, registry
+from pysh.script import readscript
+from pysh.spawn import spawn, wait
+from pysh.trace import tracer
+
+## registers echo, test, printf and the other in-process coreutils
+import pysh.coreutils
+
+## flags for the files opened by each redirection mode
+REDIRECT_FLAGS = {
+    "<": os.O_RDONLY,
+    ">": os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+    ">>": os.O_WRONLY | os.O_CREAT | os.O_APPEND
+}
+
+## what Ctrl-R puts before the line being edited to pick from the history
+HISTORY_PICK = "history pick "
+
+## fcntl only exposes F_SETPIPE_SZ from python 3.10
+F_SETPIPE_SZ = getattr(fcntl, "F_SETPIPE_SZ", 1031)
+
+## metrics of the commands run by every shell in this process
+commandcount = metrics.counter("pysh_commands_total", "Commands run, counting a pipeline once.")
+failurecount = metrics.counter("pysh_failed_commands_total", "Commands with a nonzero exit status.")
+builtincount = metrics.counter("pysh_builtin_commands_total", "Builtins run, including pipeline stages.")
+externalcount = metrics.counter("pysh_external_commands_total", "External processes spawned.")
+jobcount = metrics.counter("pysh_jobs_total", "Background jobs started.")
+activejobs = metrics.gauge("pysh_jobs_active", "Background jobs still running.")
+metrics.gauge("pysh_parsecache_hits", "Lines found in the parse cache since it was cleared.", lambda: parsecache.hits)
+metrics.gauge("pysh_parsecache_misses", "Lines parsed since the parse cache was cleared.", lambda: parsecache.misses)
+commandtime = metrics.histogram("pysh_command_duration_seconds", "Time to run each command, including waiting for it.")
+spawntime = metrics.histogram("pysh_spawn_duration_seconds", "Time to look up, redirect and spawn each external process.")
 
 def shrinkuser(path):
     if "HOME" in environ:
@@ -32,20 +68,38 @@ def shrinkuser(path):
     return path
 
 class Command(list):
+    __slots__ = ("background", "redirects")
+
     def __init__(self, *args):
-        if len(args) < 1:
-            raise IndexError("command must have a length of at least 1")
+        self.background = False
+        self.redirects = []
         if (len(args) == 1) and (" " in args[0]):
             super().__init__(args[0].split())
-        elif len(args) == 1:
-            super().__init__([args[0]])
         else:
             super().__init__(args)
 
+    ## build a command from the nodes returned by the parser, with special
+    ## parameters ("$?") taken from special
+    @classmethod
+    def fromnodes(cls, nodes, special=None):
+        cmd = cls()
+        for node in nodes:
+            if isinstance(node, Background):
+                cmd.background = True
+            elif isinstance(node, Redirect):
+                target = node.target.expand(special) if isinstance(node.target, Word) else node.target
+                cmd.redirects.append((node.fd, node.mode, target))
+            else:
+                cmd.append(node.expand(special))
+        return cmd
+
     def __str__(self):
         return " ".join(self)
 
     @property
+    def builtin(self):
+        return self[0] in registry or self[0].startswith("!")
+    @property
     def cmd(self):
         return self[0]
     @property
@@ -54,36 +108,62 @@ class Command(list):
     @property
     def argcount(self):
         return len(self[1:])
-    
-class Job(Thread):
-    def __init__(self, cmd):
-        super().__init__()
-        self.cmd = cmd
-        self.daemon = True
-        self.name = "Job-" + "".join(random.choice(string.ascii_uppercase + string.digits) for _ in range(8))
-        self.stdout = []
-        
-    def readlines(self):
-        return self.stdout
 
-    def run(self):
-        tmpfile = TemporaryFile()
-        shell = Shell(stdout=tmpfile)
-        try:
-            shell.runcmd(self.cmd)
-            shell.end(0, exception=False)
-        except Exception as e:
-            shell.print(str(e) + "\n")
-        tmpfile.seek(0)
-        self.stdout = [x.decode("utf-8") for x in tmpfile.readlines()]
-        tmpfile.close()
+## commands connected stdout to stdin, e.g. "a | b | c"
+class Pipeline(list):
+    __slots__ = ("background",)
+
+    def __init__(self, *commands):
+        self.background = False
+        super().__init__(commands)
+
+    def __str__(self):
+        return " | ".join(str(cmd) for cmd in self)
+
+    ## build a pipeline from the nodes returned by the parser
+    @classmethod
+    def fromnodes(cls, nodes, special=None):
+        pipeline = cls()
+        start = 0
+        for i, node in enumerate(nodes):
+            if isinstance(node, Pipe):
+                pipeline.append(Command.fromnodes(nodes[start:i], special))
+                start = i + 1
+        pipeline.append(Command.fromnodes(nodes[start:], special))
+        pipeline.background = pipeline[-1].background
+        pipeline[-1].background = False
+        return pipeline
 
 class Shell:
     def __init__(self, stdout=sys.stdout, stdin=sys.stdin):
         self.jobs = []
+        ## exit status of the last command, "$?"
+        self.status = 0
+        ## resource usage of each process waited for, while timing a command
+        self.usage = None
+        ## counters and histograms shared by the shells of this process
+        self.metrics = metrics
+        ## the history database of an interactive shell, and the last line read
+        self.history = None
+        self.line = None
+        ## set when the background job running this shell's builtin is
+        ## killed, for builtins that block (sleep) to return early
+        self.cancelled = None
         self.stdout = stdout
         self.stdin = stdin
 
+    ## a shell running a builtin with another stdout and stdin, sharing the
+    ## jobs, history and status of this one
+    def child(self, stdout, stdin):
+        shell = Shell(stdout=stdout, stdin=stdin)
+        shell.jobs = self.jobs
+        shell.status = self.status
+        shell.usage = self.usage
+        shell.history = self.history
+        shell.line = self.line
+        shell.cancelled = self.cancelled
+        return shell
+
     def newline(self):
         self.print("\n")
 
@@ -91,7 +171,8 @@ class Shell:
         if status > 0:
             self.newline()
         for job in self.jobs:
-            job.join()
+            job.wait()
+            job.discard()
         if exception:
             raise ShellEndedError(status)
         
@@ -108,125 +189,395 @@ class Shell:
             self.print("{0} = {1}\n".format(var, value))
     def setenv(self, var, val):
         environ[var] = val
+        if var == "PATH":
+            cmdhash.clear()
 
+    ## run a command, recording its exit status in self.status and returning
+    ## it; a command that raises gets status 127 if it was not found, 130 if
+    ## interrupted and 1 otherwise
     def runcmd(self, cmd):
-        if not isinstance(cmd, Command):
-            raise TypeError("command must be of type Command")
+        start = time.perf_counter_ns()
+        with tracer.span("runcmd", cmd=cmd) as span:
+            try:
+                self.status = self.execute(cmd)
+            except CommandNotFoundError:
+                self.status = 127
+                raise
+            except KeyboardInterrupt:
+                self.status = 130
+                raise
+            except ShellEndedError:
+                raise
+            except Exception:
+                self.status = 1
+                raise
+            finally:
+                span.args["status"] = self.status
+                commandcount.inc()
+                if self.status:
+                    failurecount.inc()
+                commandtime.record(time.perf_counter_ns() - start)
+        return self.status
+
+    def execute(self, cmd):
+        if not isinstance(cmd, (Command, Pipeline)):
+            raise TypeError("command must be of type Command or Pipeline")
         if len(cmd) == 0:
-            return
+            return 0
 
-        if cmd[-1] == "&":
-            job = Job(Command(*cmd[:-1]))
-            job.start()
-            self.jobs.append(job)
-            return
-        
-        ## inbuilt functions
+        if cmd.background:
+            cmd.background = False
+            self.startjob(cmd)
+            return 0
+
+        if isinstance(cmd, Pipeline):
+            return self.runpipeline(cmd)
+
+        ## builtins write through self.print and read self.stdin, so they run
+        ## in a child shell whose stdout and stdin are the redirected
+        ## descriptors; what they change of its status ("exit 3 > f") and
+        ## line ("history pick") is kept
+        if cmd.redirects and cmd.builtin:
+            fds = {0: self.stdin.fileno(), 1: self.stdout.fileno()}
+            opened = self.redirect(cmd, fds)
+            try:
+                self.stdout.flush()
+                with os.fdopen(os.dup(fds[1]), "wb") as stdout:
+                    cmd.redirects = []
+                    stdin = self.stdin if fds[0] == self.stdin.fileno() else os.fdopen(os.dup(fds[0]), "rb")
+                    shell = self.child(stdout, stdin)
+                    try:
+                        return shell.execute(cmd)
+                    finally:
+                        self.status, self.line = shell.status, shell.line
+                        if stdin is not self.stdin:
+                            stdin.close()
+            finally:
+                for fd in opened:
+                    os.close(fd)
         
-        ## exit: ends pysh
-        if cmd.cmd == "exit":
-            self.end(0)
-
-        ## cd: change current working directory
-        elif cmd.cmd == "cd":
-            if cmd.argcount != 1:
-                raise ArgumentCountError(cmd.argcount, 1)
-            self.cd(cmd.args[0])
-            
-        ## export: set environment variables
-        elif cmd.cmd == "export":
-            if cmd.argcount != 1:
-                raise ArgumentCountError(cmd.argcount, 1)
-            if "=" in cmd.args[0]:
-                var, val = cmd.args[0].split("=", 1)
-                self.setenv(var, val)
-            else:
-                raise ArgumentError("expected '=' in argument", 0)
-            
-        ## setenv: set environment variables in the form of "export var val"
-        elif cmd.cmd == "setenv":
-            if cmd.argcount != 2:
-                raise ArgumentCountError(cmd.argcount, 2)
-            self.setenv(cmd.args[0], cmd.args[1])
-            
-        ## printenv: print environment variables
-        elif cmd.cmd == "printenv":
-            if cmd.argcount != 0:
-                raise ArgumentCountError(cmd.argcount, 0)
-            self.printenv()
-
-        ## history: shows command history from this session
-        elif cmd.cmd == "history":
-            if cmd.argcount != 0:
-                raise ArgumentCountError(cmd.argcount, 0)
-            self.showhist()
-                
-        ## !: runs previous command by index, visible through history
-        elif cmd.cmd.startswith("!"):
-            if cmd.argcount != 0:
-                raise ArgumentCountError(cmd.argcount, 0)
-            histcmd = cmd.cmd[1:]
-            if len(histcmd) > 0:
+        ## inbuilt functions, found by name in the registry
+        with tracer.span("dispatch"):
+            func = registry.lookup("!" if cmd.cmd.startswith("!") else cmd.cmd)
+        if func is not None:
+            builtincount.inc()
+            with tracer.span("builtin", cmd=cmd.cmd):
+                status = func(self, cmd)
+            return 0 if status is None else status
+
+        ## not an inbuilt fuction, send to system
+        self.stdout.flush()
+        with tracer.span("spawn", cmd=cmd.cmd) as span:
+            pid = self.spawncmd(cmd, self.stdin.fileno(), self.stdout.fileno())
+            span.args["pid"] = pid
+        with tracer.span("wait", pid=pid):
+            return wait(pid, self.usage)
+
+    ## start an external command on the given file descriptors, returning its pid
+    def spawncmd(self, cmd, stdin, stdout, pgroup=None):
+        start = time.perf_counter_ns()
+        path = cmdhash.lookup(cmd.cmd)
+        if path is None:
+            raise CommandNotFoundError(cmd.cmd)
+        fds = {0: stdin, 1: stdout}
+        opened = self.redirect(cmd, fds)
+        try:
+            pid = spawn(cmd, path, fds=fds, pgroup=pgroup)
+        finally:
+            for fd in opened:
+                os.close(fd)
+        externalcount.inc()
+        spawntime.record(time.perf_counter_ns() - start)
+        return pid
+
+    ## apply the redirections of a command to fds, a map of the command's file
+    ## descriptors to the shell's, opening the files it names; returns the
+    ## opened descriptors, which the caller closes once the command started
+    def redirect(self, cmd, fds):
+        opened = []
+        try:
+            for fd, mode, target in cmd.redirects:
+                if mode == ">&":
+                    fds[fd] = fds.get(target, target)
+                else:
+                    opened.append(os.open(target, REDIRECT_FLAGS[mode], 0o666))
+                    fds[fd] = opened[-1]
+        except OSError:
+            for fd in opened:
+                os.close(fd)
+            raise
+        return opened
+
+    ## create a pipe, enlarged to $PYSH_PIPESIZE bytes if set
+    def pipe(self):
+        readfd, writefd = os.pipe()
+        if "PYSH_PIPESIZE" in environ:
+            try:
+                fcntl.fcntl(writefd, F_SETPIPE_SZ, int(environ["PYSH_PIPESIZE"]))
+            except (OSError, ValueError):
+                pass
+        return readfd, writefd
+
+    ## start the commands of a pipeline with each stdout connected to the
+    ## next stdin by a pipe, so data flows between the processes directly,
+    ## and return their pids along with the status of the last command if
+    ## it is a builtin. Builtin stages run in this process once every
+    ## external stage has started, or on threads of the job if one is given.
+    ## With pgroup set, the processes are put in one process group (0 for a
+    ## new group led by the first process)
+    def startpipeline(self, pipeline, stdin, stdout, pgroup=None, job=None):
+        pipes = [self.pipe() for _ in pipeline[1:]]
+        openfds = set(fd for pipe in pipes for fd in pipe)
+        pids = []
+        builtins = []
+        status = None
+        try:
+            try:
+                for i, cmd in enumerate(pipeline):
+                    cmdin = pipes[i - 1][0] if i > 0 else stdin
+                    cmdout = pipes[i][1] if i < len(pipes) else stdout
+                    if cmd.builtin:
+                        builtins.append((cmd, cmdin, cmdout, i == len(pipes)))
+                    else:
+                        pids.append(self.spawncmd(cmd, cmdin, cmdout, pgroup))
+                        if pgroup == 0:
+                            pgroup = pids[0]
+                if job is not None:
+                    job.lastpid = pids[-1] if pids and not pipeline[-1].builtin else None
+
+                ## the processes hold their own copies of the pipes, so only
+                ## the ends that builtin stages use are kept open
+                builtinfds = openfds.intersection(fd for stage in builtins for fd in stage[1:3])
+                for fd in openfds - builtinfds:
+                    os.close(fd)
+                openfds = builtinfds
+
+                for cmd, cmdin, cmdout, last in builtins:
+                    ## each stage is given descriptors of its own to close
+                    if cmdin == self.stdin.fileno():
+                        cmdin = None
+                    elif cmdin in openfds:
+                        openfds.discard(cmdin)
+                    else:
+                        cmdin = os.dup(cmdin)
+                    if cmdout in openfds:
+                        openfds.discard(cmdout)
+                    else:
+                        cmdout = os.dup(cmdout)
+                    if job is None:
+                        result = self.runstage(cmd, cmdin, cmdout)
+                        if last:
+                            status = result
+                    else:
+                        job.runthread(partial(self.runstage, cmd, cmdin, cmdout, job.cancelled), last)
+            finally:
+                for fd in openfds:
+                    os.close(fd)
+        except BaseException:
+            for pid in pids:
+                wait(pid)
+            raise
+        return pids, status
+
+    ## run a builtin stage of a pipeline on the given descriptors (None for
+    ## the shell's stdin), closing them once it is done, and return its status
+    def runstage(self, cmd, stdin, stdout, cancelled=None):
+        with os.fdopen(stdout, "wb") as out:
+            try:
+                if stdin is None:
+                    shell = self.child(out, self.stdin)
+                else:
+                    shell = self.child(out, os.fdopen(stdin, "rb"))
+                if cancelled is not None:
+                    shell.cancelled = cancelled
                 try:
-                    histindex = int(histcmd)
-                    if histindex > 0:
-                        histindex -= 1
-                    elif histindex < 0:
-                        histindex += readline.get_current_history_length() - 1
-                    selectcmd = readline.get_history_item(histindex)
-                    readline.add_history(selectcmd)
-                    self.runcmd(Command(selectcmd))
-                except ValueError:
-                    if histcmd == "!":
-                        selectcmd = readline.get_history_item(readline.get_current_history_length() - 1)
-                        readline.add_history(selectcmd)
-                        self.runcmd(Command(selectcmd))
-                    elif histcmd == "-":
-                        self.clearhist()
-            else:
-                raise ArgumentError("expected character after '!'")
-
-        ## jobs: shows background tasks
-        elif cmd.cmd == "jobs":
-            if cmd.argcount != 0:
-                raise ArgumentCountError(cmd.argcount, 0)
-            self.showjobs()
-        ## job: shows the output of a background task
-        elif cmd.cmd == "job":
-            if cmd.argcount != 1:
-                raise ArgumentCountError(cmd.argcount, 1)
-            if not cmd.args[0].startswith("j"):
-                raise ArgumentError("expected job identifier but found \"{0}\"".format(cmd.args[0]))
-            self.outputjob(int(cmd.args[0][1:]))
-
-        ## kill: kills a background task or process
-        elif cmd.cmd == "kill":
-            if cmd.argcount != 1:
-                raise ArgumentCountError(cmd.argcount, 1)
-            if cmd.args[0].startswith("j"):
-                self.killjob(int(cmd.args[0][1:]))
+                    return shell.execute(cmd)
+                finally:
+                    if stdin is not None:
+                        shell.stdin.close()
+            except Exception as e:
+                self.print(str(e) + "\n")
+                return 1
+
+    ## run a pipeline in the foreground and return the status of its last command
+    def runpipeline(self, pipeline):
+        self.stdout.flush()
+        with tracer.span("spawn", pipeline=pipeline) as span:
+            pids, status = self.startpipeline(pipeline, self.stdin.fileno(), self.stdout.fileno())
+            span.args["pids"] = pids
+        with tracer.span("wait", pids=pids):
+            statuses = [wait(pid, self.usage) for pid in pids]
+        return statuses[-1] if status is None else status
+
+    ## run a command line as a background job in its own process group, with
+    ## stdin from /dev/null and its output read from a pipe into the job, and
+    ## return the job, which embedding code can await
+    def startjob(self, cmd):
+        try:
+            buffersize = int(environ.get("PYSH_JOBBUFFER", PYSH_JOBBUFFER_SIZE))
+        except ValueError:
+            buffersize = PYSH_JOBBUFFER_SIZE
+        job = Job(cmd, buffersize)
+        self.jobs.append(job)
+        jobcount.inc()
+        activejobs.inc()
+        job.ondone(activejobs.dec)
+        if isinstance(cmd, Command):
+            cmd = Pipeline(cmd)
+        readfd, writefd = self.pipe()
+        job.collect(readfd)
+        pids = []
+        try:
+            with open(os.devnull, "rb") as devnull:
+                pids, _ = self.startpipeline(cmd, devnull.fileno(), writefd, pgroup=0, job=job)
+        finally:
+            os.close(writefd)
+            job.start(pids)
+        return job
+
+    ## parallel [-j N] [-k] [--joblog FILE] cmd [args] [::: inputs]: without
+    ## ":::" the inputs are the lines of stdin. -j 0 runs every input at once.
+    ## Returns the number of tasks that failed
+    def parallel(self, args):
+        jobs = os.cpu_count() or 1
+        keeporder = False
+        joblog = None
+        i = 0
+        while i < len(args) and args[i].startswith("-"):
+            if args[i] == "-k":
+                keeporder = True
+            elif args[i] in ("-j", "--joblog") and i + 1 < len(args):
+                if args[i] == "--joblog":
+                    joblog = args[i + 1]
+                elif args[i + 1].isdigit():
+                    jobs = int(args[i + 1]) or sys.maxsize
+                else:
+                    raise ArgumentError("expected number of jobs but found \"{0}\"".format(args[i + 1]), i + 1)
+                i += 1
             else:
-                self.killproc(int(cmd.args[0]))
+                raise ArgumentError("unknown option \"{0}\"".format(args[i]), i)
+            i += 1
 
-        ## not an inbuilt fuction, send to system
+        template = Command()
+        while i < len(args) and args[i] != ":::":
+            template.append(args[i])
+            i += 1
+        if not template:
+            raise ArgumentError("expected command", i)
+        if i < len(args):
+            inputs = args[i + 1:]
         else:
-            subprocess.call(cmd, stdout=self.stdout, stdin=self.stdin)
+            inputs = (line.decode("utf-8", "replace") if isinstance(line, bytes) else line for line in self.stdin)
+            inputs = (line.rstrip("\n") for line in inputs)
+
+        self.stdout.flush()
+        if joblog is None:
+            return Parallel(self, template, jobs, keeporder).run(inputs)
+        with open(joblog, "w") as log:
+            return Parallel(self, template, jobs, keeporder, log).run(inputs)
 
     def clearhist(self):
         readline.clear_history()
+        if self.history is not None:
+            self.history.clear()
     def showhist(self):
         for i in range(readline.get_current_history_length() - 1):
-            self.print("({0}) {1}\n".format(i + 1, readline.get_history_item(i)))
+            self.print("({0}) {1}\n".format(i + 1, readline.get_history_item(i + 1)))
+    ## the history database of this shell, or one opened for a search from a
+    ## non-interactive shell
+    def histstore(self):
+        if self.history is None:
+            from pysh.history import HistoryStore
+            return HistoryStore(PYSH_HISTDB)
+        return self.history
+    def searchhist(self, query, limit):
+        for i, line in enumerate(self.histstore().search(query, limit)):
+            self.print("({0}) {1}\n".format(i + 1, line))
+    ## show the matches for query and read the number of one to edit at the
+    ## next prompt; bound to Ctrl-R in interactive shells
+    def pickhist(self, query, limit):
+        matches = self.histstore().search(query, limit)
+        if not matches:
+            self.print("no match for {0}\n".format(query))
+            return 1
+        for i, line in reversed(list(enumerate(matches))):
+            self.print("({0}) {1}\n".format(i + 1, line))
+        self.print("pick [1]: ")
+        self.stdout.flush()
+        choice = self.stdin.readline().strip() or "1"
+        if not choice.isdigit() or not 0 < int(choice) <= len(matches):
+            return 1
+        def prefill():
+            readline.insert_text(matches[int(choice) - 1])
+            readline.redisplay()
+            readline.set_pre_input_hook(None)
+        readline.set_pre_input_hook(prefill)
+        return 0
+
+    def showparsecache(self):
+        self.print("{0}/{1} entries, {2} hits, {3} misses\n".format(len(parsecache), parsecache.size, parsecache.hits, parsecache.misses))
 
+    def showhash(self, reusable=False):
+        if reusable:
+            for name, (path, hits) in cmdhash:
+                self.print("hash -p {0} {1}\n".format(path, name))
+            return
+        self.print("hits\tcommand\n")
+        for name, (path, hits) in cmdhash:
+            self.print("{0:4}\t{1}\n".format(hits, path))
+        lookups = cmdhash.hits + cmdhash.misses
+        if lookups:
+            self.print("{0} hits, {1} misses ({2:.1%} hit rate)\n".format(cmdhash.hits, cmdhash.misses, cmdhash.hits / lookups))
+
+    ## report the resources a command used, from the shell's own usage and
+    ## that of its waited for children since before, and the usage of each
+    ## process waited for (which alone gives a meaningful maximum RSS; on
+    ## linux a child's includes the memory it shared with the shell until exec)
+    def showtime(self, real, before, childbefore, waited):
+        after = resource.getrusage(resource.RUSAGE_SELF)
+        childafter = resource.getrusage(resource.RUSAGE_CHILDREN)
+        def delta(field):
+            return getattr(after, field) - getattr(before, field) + getattr(childafter, field) - getattr(childbefore, field)
+        maxrss = max(usage.ru_maxrss for usage in waited) if waited else after.ru_maxrss
+        report = "\nreal\t{0}\nuser\t{1}\nsys\t{2}\n".format(*(
+            "{0}m{1:.3f}s".format(int(seconds // 60), seconds % 60) for seconds in (real, delta("ru_utime"), delta("ru_stime"))))
+        report += "maxrss\t{0} KiB\nfaults\t{1} major, {2} minor\nctxsw\t{3} voluntary, {4} involuntary\n".format(
+            maxrss, delta("ru_majflt"), delta("ru_minflt"), delta("ru_nvcsw"), delta("ru_nivcsw"))
+        self.stdout.flush()
+        sys.stderr.write(report)
+        sys.stderr.flush()
+
+    ## kill a job's processes and cancel its builtin stages; a builtin that
+    ## cannot be interrupted keeps running, so a job with any is not waited for
     def killjob(self, ident):
-        self.jobs.pop(ident - 1).join()
+        job = self.jobs.pop(ident - 1)
+        job.kill()
+        if job.threads:
+            job.ondone(job.discard)
+        else:
+            job.wait()
+            job.discard()
     def killproc(self, ident):
         os.kill(ident, signal.SIGKILL)
-    def outputjob(self, ident):
-        self.print("".join(self.jobs[ident - 1].readlines()))
+    ## stream a job's output, or its first or last lines, or a range of bytes
+    def outputjob(self, ident, head=None, tail=None, start=0, end=None):
+        output = self.jobs[ident - 1].output
+        if head is not None:
+            end = output.headoffset(head)
+        elif tail is not None:
+            start = output.tailoffset(tail)
+        for data in output.chunks(start, end):
+            self.write(data)
     def showjobs(self):
         for ident, job in enumerate(self.jobs):
+            job.notified = not job.running
             self.print("({0}) {1}\n".format(ident + 1, str(job)))
+    ## report jobs that have finished since they were last shown
+    def notifyjobs(self):
+        for ident, job in enumerate(self.jobs):
+            if not job.running and not job.notified:
+                job.notified = True
+                self.print("({0}) {1}\n".format(ident + 1, str(job)))
 
     ## write text to stdout
     def print(self, obj):
@@ -234,6 +585,307 @@ class Shell:
             self.stdout.write(obj.encode("utf-8"))
         except Exception:
             self.stdout.write(str(obj))
-    ## read text from stdin
+    ## write bytes to stdout undecoded
+    def write(self, data):
+        try:
+            self.stdout.write(data)
+        except TypeError:
+            self.stdout.flush()
+            self.stdout.buffer.write(data)
+            self.stdout.buffer.flush()
+    ## parse a line of text into a command
+    def parse(self, line):
+        with tracer.span("parse", line=line):
+            nodes = parse(line)
+            if "!" in line:
+                expanded = self.expandhist(line, nodes)
+                if expanded is not line:
+                    nodes = parse(expanded)
+        return self.build(nodes)
+    ## bring the history index up to date with readline, leaving out an
+    ## interactive shell's own line, which is the last item; returns the
+    ## number of items
+    def synchist(self):
+        length = readline.get_current_history_length()
+        histindex.sync(length - 1 if self.history is not None else length)
+        return length
+    ## replace the history events anywhere in a line with what they refer
+    ## to, as bash does before parsing, echoing the result to stderr and
+    ## putting it in the history in place of the line. "!-" and "!=" are
+    ## left to the ! builtin
+    def expandhist(self, line, nodes):
+        events = [node.value for node in nodes if isinstance(node, Word) and node.kind == "HISTCMD"
+                  and node.value not in ("!", "!-", "!=")]
+        if not events:
+            return line
+        length = self.synchist()
+        position = 0
+        for event in events:
+            start = line.index(event, position)
+            expansion = histindex.expand(event)
+            line = line[:start] + expansion + line[start + len(event):]
+            position = start + len(expansion)
+        self.sethist(line, length)
+        return line
+    ## echo an expanded line and record it in place of an interactive
+    ## shell's own line
+    def sethist(self, line, length):
+        ## echoed to stderr like bash, so it stays out of pipes and redirections
+        sys.stderr.write(line + "\n")
+        sys.stderr.flush()
+        if self.history is not None and length:
+            readline.replace_history_item(length - 1, line)
+            self.line = line
+    ## build a command from parsed nodes
+    def build(self, nodes):
+        special = {"?": str(self.status)}
+        with tracer.span("build"):
+            for node in nodes:
+                if isinstance(node, Pipe):
+                    return Pipeline.fromnodes(nodes, special)
+            return Command.fromnodes(nodes, special)
+    ## run the commands of a script file as they are read; a failing command
+    ## is reported and the script carries on, up to "exit" or the end
+    def runscript(self, path):
+        for nodes in readscript(path):
+            try:
+                self.runcmd(self.build(nodes))
+            except ShellEndedError:
+                raise
+            except Exception as e:
+                self.print(str(e) + "\n")
+    ## read text from stdin. Ctrl-R submits the line being edited after
+    ## "history pick "; that text is the query as typed rather than part of
+    ## a command, so it is passed on without being parsed (a ">", "|" or "&"
+    ## in it would otherwise redirect, pipe or background the picker)
     def input(self, string):
-        return Command(parser.parse(input(string)))
+        with tracer.span("input"):
+            self.line = line = input(string)
+        if line.startswith(HISTORY_PICK):
+            return Command("history", "pick", line[len(HISTORY_PICK):].strip())
+        return self.parse(line)
+
+## builtin commands, each called with the shell and the command; plugins
+## register theirs the same way with pysh.registry.builtin
+
+## exit: ends pysh, with the given status or that of the last command
+@builtin("exit")
+def exitbuiltin(shell, cmd):
+    if cmd.argcount > 1:
+        raise ArgumentCountError(cmd.argcount, 1)
+    if cmd.argcount == 1:
+        try:
+            shell.status = int(cmd.args[0]) & 0xff
+        except ValueError:
+            raise ArgumentError("expected exit status but found \"{0}\"".format(cmd.args[0]), 0)
+    shell.end(0)
+
+## cd: change current working directory
+@builtin("cd")
+def cdbuiltin(shell, cmd):
+    if cmd.argcount != 1:
+        raise ArgumentCountError(cmd.argcount, 1)
+    shell.cd(cmd.args[0])
+
+## export: set environment variables
+@builtin("export")
+def exportbuiltin(shell, cmd):
+    if cmd.argcount != 1:
+        raise ArgumentCountError(cmd.argcount, 1)
+    if "=" in cmd.args[0]:
+        var, val = cmd.args[0].split("=", 1)
+        shell.setenv(var, val)
+    else:
+        raise ArgumentError("expected '=' in argument", 0)
+
+## setenv: set environment variables in the form of "export var val"
+@builtin("setenv")
+def setenvbuiltin(shell, cmd):
+    if cmd.argcount != 2:
+        raise ArgumentCountError(cmd.argcount, 2)
+    shell.setenv(cmd.args[0], cmd.args[1])
+
+## printenv: print environment variables
+@builtin("printenv")
+def printenvbuiltin(shell, cmd):
+    if cmd.argcount != 0:
+        raise ArgumentCountError(cmd.argcount, 0)
+    shell.printenv()
+
+## history [search [-n N] TEXT... | pick TEXT...]: shows command history from
+## this session, or the distinct commands of every session best matching
+## TEXT. "pick" asks for one of them to edit at the next prompt, which is
+## what Ctrl-R runs
+@builtin("history")
+def historybuiltin(shell, cmd):
+    if cmd.argcount == 0:
+        shell.showhist()
+        return 0
+    args = cmd.args[1:]
+    limit = PYSH_HISTSEARCH_SIZE
+    if cmd.args[0] == "search" and args[:1] == ["-n"]:
+        if len(args) < 2 or not args[1].isdigit():
+            raise ArgumentError("expected number of matches after -n", 2)
+        limit = int(args[1])
+        args = args[2:]
+    if cmd.args[0] == "search":
+        shell.searchhist(" ".join(args), limit)
+    elif cmd.args[0] == "pick":
+        ## the picking line itself is left out of the history
+        if shell.history is not None:
+            readline.remove_history_item(readline.get_current_history_length() - 1)
+            shell.line = ""
+        return shell.pickhist(" ".join(args), limit)
+    else:
+        raise ArgumentError("expected \"search\" or \"pick\"", 0)
+
+## !: runs a previous command, by number as shown by history ("!N"), counting
+## back ("!-N", "!!"), by prefix ("!git") or by substring ("!?status?"), or
+## some of its words (":N", ":N-M", ":^", ":$", ":*"), with any arguments
+## appended; "!-" clears the history. Lines read by Shell.parse have their
+## events expanded before they run, so this serves script lines
+@builtin("!")
+def histcmdbuiltin(shell, cmd):
+    if cmd.cmd == "!":
+        raise ArgumentError("expected character after '!'", 0)
+    if cmd.cmd == "!-":
+        shell.clearhist()
+        return 0
+    if cmd.cmd == "!=":
+        return 0
+    length = shell.synchist()
+    selectcmd = " ".join([histindex.expand(cmd.cmd)] + cmd.args)
+    shell.sethist(selectcmd, length)
+    return shell.runcmd(shell.parse(selectcmd))
+
+## parsecache: shows parse cache statistics, or clears it with "-c"
+@builtin("parsecache")
+def parsecachebuiltin(shell, cmd):
+    if cmd.argcount > 1:
+        raise ArgumentCountError(cmd.argcount, 1)
+    if cmd.argcount == 0:
+        shell.showparsecache()
+    elif cmd.args[0] == "-c":
+        parsecache.clear()
+    else:
+        raise ArgumentError("unknown option \"{0}\"".format(cmd.args[0]), 0)
+
+## hash: shows remembered command locations ("-l" in reusable form),
+## forgets them with "-r", remembers PATH as the location of NAME with
+## "-p PATH NAME" or remembers the given commands
+@builtin("hash")
+def hashbuiltin(shell, cmd):
+    if cmd.argcount == 0:
+        shell.showhash()
+    elif cmd.args == ["-r"]:
+        cmdhash.clear()
+    elif cmd.args == ["-l"]:
+        shell.showhash(reusable=True)
+    elif cmd.args[0] == "-p":
+        if cmd.argcount != 3:
+            raise ArgumentCountError(cmd.argcount, 3)
+        if "/" in cmd.args[2]:
+            raise ArgumentError("command name \"{0}\" contains \"/\"".format(cmd.args[2]), 2)
+        cmdhash.remember(cmd.args[2], cmd.args[1])
+    else:
+        for name in cmd.args:
+            if cmdhash.lookup(name) is None:
+                raise CommandNotFoundError(name)
+
+## jobs: shows background tasks
+@builtin("jobs")
+def jobsbuiltin(shell, cmd):
+    if cmd.argcount != 0:
+        raise ArgumentCountError(cmd.argcount, 0)
+    shell.showjobs()
+
+## job: shows the output of a background task, or part of it:
+## "head N" or "tail N" lines, or the bytes from "range START END"
+@builtin("job")
+def jobbuiltin(shell, cmd):
+    if cmd.argcount not in (1, 3, 4):
+        raise ArgumentCountError(cmd.argcount, 1)
+    if not cmd.args[0].startswith("j"):
+        raise ArgumentError("expected job identifier but found \"{0}\"".format(cmd.args[0]), 0)
+    ident = int(cmd.args[0][1:])
+    if cmd.argcount == 1:
+        shell.outputjob(ident)
+    elif cmd.args[1] == "head" and cmd.argcount == 3:
+        shell.outputjob(ident, head=int(cmd.args[2]))
+    elif cmd.args[1] == "tail" and cmd.argcount == 3:
+        shell.outputjob(ident, tail=int(cmd.args[2]))
+    elif cmd.args[1] == "range" and cmd.argcount == 4:
+        shell.outputjob(ident, start=int(cmd.args[2]), end=int(cmd.args[3]))
+    else:
+        raise ArgumentError("expected head N, tail N or range START END but found \"{0}\"".format(" ".join(cmd.args[1:])), 1)
+
+## kill: kills a background task or process
+@builtin("kill")
+def killbuiltin(shell, cmd):
+    if cmd.argcount != 1:
+        raise ArgumentCountError(cmd.argcount, 1)
+    if cmd.args[0].startswith("j"):
+        shell.killjob(int(cmd.args[0][1:]))
+    else:
+        shell.killproc(int(cmd.args[0]))
+
+## time: runs a command and reports its wall and CPU time, maximum resident
+## set size, page faults and context switches on stderr
+@builtin("time")
+def timebuiltin(shell, cmd):
+    timed = Command()
+    timed.extend(cmd.args)
+    outer, shell.usage = shell.usage, []
+    before = resource.getrusage(resource.RUSAGE_SELF)
+    childbefore = resource.getrusage(resource.RUSAGE_CHILDREN)
+    start = time.perf_counter()
+    try:
+        if timed:
+            return shell.runcmd(timed)
+    finally:
+        real = time.perf_counter() - start
+        waited, shell.usage = shell.usage, outer
+        if outer is not None:
+            outer.extend(waited)
+        shell.showtime(real, before, childbefore, waited)
+
+## trace on [FILE] | off: writes spans for each phase of every command and
+## background job to FILE (by default the last file traced to) as Chrome
+## trace events, for Perfetto or chrome://tracing
+@builtin("trace")
+def tracebuiltin(shell, cmd):
+    if cmd.argcount == 0:
+        shell.print("tracing {0}\n".format("to " + tracer.path if tracer.enabled else "off"))
+    elif cmd.args[0] == "on" and cmd.argcount <= 2:
+        try:
+            tracer.start(cmd.args[1] if cmd.argcount == 2 else None)
+        except ValueError:
+            raise ArgumentError("expected trace file", 1)
+    elif cmd.args == ["off"]:
+        tracer.stop()
+    else:
+        raise ArgumentError("expected \"on [FILE]\" or \"off\"", 0)
+
+## stats [prometheus | reset | serve [SOCKET] | stop]: shows the command
+## metrics, in the Prometheus text format if asked, or serves that format on
+## a unix socket until stopped
+@builtin("stats")
+def statsbuiltin(shell, cmd):
+    if cmd.argcount == 0:
+        shell.print(shell.metrics.report())
+    elif cmd.args == ["prometheus"]:
+        shell.print(shell.metrics.prometheus())
+    elif cmd.args == ["reset"]:
+        shell.metrics.reset()
+    elif cmd.args[0] == "serve" and cmd.argcount <= 2:
+        shell.metrics.serve(cmd.args[1] if cmd.argcount == 2 else PYSH_METRICS_SOCKET)
+    elif cmd.args == ["stop"]:
+        shell.metrics.stopserving()
+    else:
+        raise ArgumentError("expected \"prometheus\", \"reset\", \"serve [SOCKET]\" or \"stop\"", 0)
+
+## parallel: runs a command for each input on a pool of processes
+@builtin("parallel")
+def parallelbuiltin(shell, cmd):
+    ## like GNU parallel, the status is the number of failed tasks, up to 101
+    return min(shell.parallel(cmd.args), 101)
@@ -0,0 +1,578 @@
+#!/usr/bin/python3
+## Copyright 2015 Kevin Boxhoorn
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##   http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+## coreutils.py
+##
+## In-process versions of the coreutils commands scripts run most often, so
+## they cost a function call rather than a fork and exec. Their output and
+## exit statuses follow GNU coreutils.
+
+import os, signal, stat, sys, time
+from os.path import samefile
+
+from pysh.registry import builtin
+
+## write a diagnostic to stderr, as coreutils does, so it stays out of pipes
+## and redirected output; stdout is flushed first to keep the two in order
+def error(shell, message):
+    shell.stdout.flush()
+    sys.stderr.write(message + "\n")
+    sys.stderr.flush()
+
+## backslash escapes understood by "echo -e", "printf" formats and "%b"
+ESCAPES = {"\\": "\\", "a": "\a", "b": "\b", "e": "\x1b", "f": "\f", "n": "\n", "r": "\r", "t": "\t", "v": "\v", "\"": "\"", "'": "'"}
+
+## expand the backslash escapes of text, returning the expanded text and
+## whether a "\c" asked for output to stop. Octal escapes are "\0NNN" for
+## echo and %b, and "\NNN" in printf formats
+def unescape(text, format=False):
+    out = []
+    i = 0
+    while i < len(text):
+        char = text[i]
+        i += 1
+        if char != "\\" or i == len(text):
+            out.append(char)
+            continue
+        char = text[i]
+        i += 1
+        if char in ESCAPES:
+            out.append(ESCAPES[char])
+        elif char == "c":
+            return "".join(out), True
+        elif char in "01234567" and (format or char == "0"):
+            start = i - 1 if format else i
+            end = start
+            while end < len(text) and end < start + 3 and text[end] in "01234567":
+                end += 1
+            out.append(chr(int(text[start:end] or "0", 8) & 0xff))
+            i = end
+        elif char in "xuU":
+            digits = {"x": 2, "u": 4, "U": 8}[char]
+            end = i
+            while end < len(text) and end < i + digits and text[end] in "0123456789abcdefABCDEF":
+                end += 1
+            if end == i:
+                out.append("\\" + char)
+            else:
+                out.append(chr(int(text[i:end], 16)))
+                i = end
+        else:
+            out.append("\\" + char)
+    return "".join(out), False
+
+## echo [-neE] [string ...]
+@builtin("echo")
+def echo(shell, cmd):
+    args = cmd.args
+    newline = True
+    escapes = False
+    while args and len(args[0]) > 1 and args[0][0] == "-" and all(c in "neE" for c in args[0][1:]):
+        for option in args[0][1:]:
+            if option == "n":
+                newline = False
+            else:
+                escapes = option == "e"
+        args = args[1:]
+    text = " ".join(args)
+    if escapes:
+        text, stop = unescape(text)
+        if stop:
+            newline = False
+    shell.print(text + "\n" if newline else text)
+
+@builtin("true")
+def true(shell, cmd):
+    return 0
+
+@builtin("false")
+def false(shell, cmd):
+    return 1
+
+## pwd [-LP]: like coreutils, the physical directory unless -L is given and
+## $PWD names the working directory
+@builtin("pwd")
+def pwd(shell, cmd):
+    logical = False
+    for arg in cmd.args:
+        if arg in ("-L", "-P"):
+            logical = arg == "-L"
+        else:
+            error(shell, "pwd: invalid option -- '{0}'".format(arg.lstrip("-")))
+            return 1
+    cwd = os.getcwd()
+    if logical:
+        path = os.environ.get("PWD", "")
+        try:
+            if path.startswith("/") and "/./" not in path + "/" and "/../" not in path + "/" and samefile(path, "."):
+                cwd = path
+        except OSError:
+            pass
+    shell.print(cwd + "\n")
+
+## basename NAME [SUFFIX], basename -a [-s SUFFIX] [-z] NAME...
+@builtin("basename")
+def basename(shell, cmd):
+    args = cmd.args
+    multiple = False
+    suffix = ""
+    end = "\n"
+    while args and args[0].startswith("-") and len(args[0]) > 1:
+        if args[0] == "-a":
+            multiple = True
+        elif args[0] == "-s" and len(args) > 1:
+            multiple = True
+            suffix = args[1]
+            args = args[1:]
+        elif args[0] == "-z":
+            end = "\0"
+        elif args[0] == "--":
+            args = args[1:]
+            break
+        else:
+            error(shell, "basename: invalid option -- '{0}'".format(args[0].lstrip("-")))
+            return 1
+        args = args[1:]
+    if not args:
+        error(shell, "basename: missing operand")
+        return 1
+    if not multiple:
+        if len(args) > 2:
+            error(shell, "basename: extra operand '{0}'".format(args[2]))
+            return 1
+        if len(args) == 2:
+            suffix = args[1]
+        args = args[:1]
+    for name in args:
+        stripped = name.rstrip("/")
+        if not stripped:
+            base = "/" if name else ""
+        else:
+            base = stripped.rsplit("/", 1)[-1]
+            if suffix and base != suffix and base.endswith(suffix):
+                base = base[:-len(suffix)]
+        shell.print(base + end)
+
+## dirname [-z] NAME...
+@builtin("dirname")
+def dirname(shell, cmd):
+    args = cmd.args
+    end = "\n"
+    if args and args[0] == "-z":
+        end = "\0"
+        args = args[1:]
+    if not args:
+        error(shell, "dirname: missing operand")
+        return 1
+    for name in args:
+        stripped = name.rstrip("/")
+        if not stripped:
+            parent = "/" if name else "."
+        elif "/" not in stripped:
+            parent = "."
+        else:
+            parent = stripped.rsplit("/", 1)[0].rstrip("/") or "/"
+        shell.print(parent + end)
+
+## sleep NUMBER[SUFFIX]...: sleeps for the sum of the intervals, each in
+## seconds unless suffixed with m, h or d
+@builtin("sleep")
+def sleep(shell, cmd):
+    if not cmd.args:
+        error(shell, "sleep: missing operand")
+        return 1
+    seconds = 0
+    for arg in cmd.args:
+        number, multiplier = arg, 1
+        if arg[-1:] in ("s", "m", "h", "d"):
+            number, multiplier = arg[:-1], {"s": 1, "m": 60, "h": 3600, "d": 86400}[arg[-1]]
+        try:
+            value = float(number)
+        except ValueError:
+            value = -1
+        if not value >= 0:
+            error(shell, "sleep: invalid time interval '{0}'".format(arg))
+            return 1
+        seconds += value * multiplier
+    while seconds > 0:
+        interval = min(seconds, 86400)
+        if shell.cancelled is None:
+            time.sleep(interval)
+        elif shell.cancelled.wait(interval):
+            ## the job was killed, as if by SIGKILL
+            return 128 + signal.SIGKILL
+        seconds -= interval
+
+class TestError(Exception):
+    pass
+
+## test file operators, on the result of os.stat (or os.lstat for -h and -L)
+FILETESTS = {
+    "-b": stat.S_ISBLK,
+    "-c": stat.S_ISCHR,
+    "-d": stat.S_ISDIR,
+    "-e": lambda mode: True,
+    "-f": stat.S_ISREG,
+    "-g": lambda mode: bool(mode & stat.S_ISGID),
+    "-h": stat.S_ISLNK,
+    "-k": lambda mode: bool(mode & stat.S_ISVTX),
+    "-L": stat.S_ISLNK,
+    "-p": stat.S_ISFIFO,
+    "-S": stat.S_ISSOCK,
+    "-u": lambda mode: bool(mode & stat.S_ISUID),
+}
+ACCESSTESTS = {"-r": os.R_OK, "-w": os.W_OK, "-x": os.X_OK}
+UNARY = frozenset(FILETESTS).union(ACCESSTESTS, ("-G", "-N", "-O", "-s", "-t", "-n", "-z"))
+INTEGERS = {
+    "-eq": lambda a, b: a == b,
+    "-ne": lambda a, b: a != b,
+    "-lt": lambda a, b: a < b,
+    "-le": lambda a, b: a <= b,
+    "-gt": lambda a, b: a > b,
+    "-ge": lambda a, b: a >= b,
+}
+BINARY = frozenset(INTEGERS).union(("=", "==", "!=", "-nt", "-ot", "-ef"))
+
+def testinteger(value):
+    try:
+        return int(value.strip())
+    except ValueError:
+        raise TestError("invalid integer '{0}'".format(value))
+
+def testunary(op, arg):
+    if op == "-n":
+        return arg != ""
+    if op == "-z":
+        return arg == ""
+    if op == "-t":
+        try:
+            return os.isatty(testinteger(arg))
+        except OSError:
+            return False
+    if op in ACCESSTESTS:
+        return os.access(arg, ACCESSTESTS[op])
+    try:
+        st = os.lstat(arg) if op in ("-h", "-L") else os.stat(arg)
+    except (OSError, ValueError):
+        return False
+    if op in FILETESTS:
+        return FILETESTS[op](st.st_mode)
+    if op == "-s":
+        return st.st_size > 0
+    if op == "-G":
+        return st.st_gid == os.getegid()
+    if op == "-O":
+        return st.st_uid == os.geteuid()
+    ## -N: modified since last read
+    return st.st_mtime > st.st_atime
+
+def testbinary(left, op, right):
+    if op in ("=", "=="):
+        return left == right
+    if op == "!=":
+        return left != right
+    if op in INTEGERS:
+        return INTEGERS[op](testinteger(left), testinteger(right))
+    try:
+        if op == "-ef":
+            return samefile(left, right)
+        mtimes = []
+        for path in (left, right):
+            try:
+                mtimes.append(os.stat(path).st_mtime_ns)
+            except OSError:
+                mtimes.append(None)
+    except OSError:
+        return False
+    if op == "-nt":
+        return mtimes[0] is not None and (mtimes[1] is None or mtimes[0] > mtimes[1])
+    return mtimes[1] is not None and (mtimes[0] is None or mtimes[0] < mtimes[1])
+
+## evaluates a test expression; up to four arguments are decided by their
+## count as POSIX specifies, longer ones by recursive descent with "!", "-a",
+## "-o" and parentheses
+class TestExpression:
+    def __init__(self, args):
+        self.args = args
+        self.pos = 0
+
+    def evaluate(self):
+        args = self.args
+        if len(args) == 0:
+            return False
+        if len(args) == 1:
+            return args[0] != ""
+        if len(args) == 2:
+            if args[0] == "!":
+                return args[1] == ""
+            if args[0] in UNARY:
+                return testunary(args[0], args[1])
+            raise TestError("'{0}': unary operator expected".format(args[0]))
+        if len(args) == 3:
+            if args[1] in BINARY:
+                return testbinary(*args)
+            if args[0] == "!":
+                return not TestExpression(args[1:]).evaluate()
+            if args[0] == "(" and args[2] == ")":
+                return args[1] != ""
+        if len(args) == 4:
+            if args[0] == "!":
+                return not TestExpression(args[1:]).evaluate()
+            if args[0] == "(" and args[3] == ")":
+                return TestExpression(args[1:3]).evaluate()
+        result = self.disjunction()
+        if self.pos < len(args):
+            raise TestError("extra argument '{0}'".format(args[self.pos]))
+        return result
+
+    def next(self):
+        if self.pos >= len(self.args):
+            raise TestError("argument expected")
+        self.pos += 1
+        return self.args[self.pos - 1]
+
+    def peek(self, offset=0):
+        if self.pos + offset < len(self.args):
+            return self.args[self.pos + offset]
+        return None
+
+    def disjunction(self):
+        result = self.conjunction()
+        while self.peek() == "-o":
+            self.pos += 1
+            result = self.conjunction() or result
+        return result
+
+    def conjunction(self):
+        result = self.negation()
+        while self.peek() == "-a":
+            self.pos += 1
+            result = self.negation() and result
+        return result
+
+    def negation(self):
+        if self.peek() == "!":
+            self.pos += 1
+            return not self.negation()
+        return self.primary()
+
+    def primary(self):
+        if self.peek(1) in BINARY:
+            return testbinary(self.next(), self.next(), self.next())
+        token = self.next()
+        if token == "(":
+            result = self.disjunction()
+            if self.next() != ")":
+                raise TestError("')' expected")
+            return result
+        if token in UNARY and self.peek() is not None:
+            return testunary(token, self.next())
+        return token != ""
+
+def runtest(shell, name, args):
+    try:
+        return 0 if TestExpression(args).evaluate() else 1
+    except TestError as e:
+        error(shell, "{0}: {1}".format(name, e))
+        return 2
+
+## test EXPRESSION
+@builtin("test")
+def test(shell, cmd):
+    return runtest(shell, "test", cmd.args)
+
+## [ EXPRESSION ]
+@builtin("[")
+def bracket(shell, cmd):
+    if not cmd.args or cmd.args[-1] != "]":
+        error(shell, "[: missing ']'")
+        return 2
+    return runtest(shell, "[", cmd.args[:-1])
+
+## characters %q quotes anywhere in a word, and those it quotes at its start
+SHELL_SPECIAL = set(" \t\n!\"$&'()*;<=>?[\\]^`|")
+SHELL_SPECIAL_START = "#~"
+
+## quotes text for the shell the way "printf %q" does: unchanged if nothing
+## needs quoting, in double quotes if it only holds a "'", and otherwise in
+## single quotes, with characters that cannot be printed as $'\NNN'
+def shellquote(text):
+    if not text:
+        return "''"
+    printable = text.isprintable()
+    if printable and text[0] not in SHELL_SPECIAL_START and not SHELL_SPECIAL.intersection(text):
+        return text
+    if printable and "'" in text and not set("$`\\\"!").intersection(text):
+        return "\"" + text + "\""
+    out = ["'"]
+    quoted = True
+    for char in text:
+        if char.isprintable():
+            if not quoted:
+                out.append("'")
+                quoted = True
+            out.append("'\\''" if char == "'" else char)
+            continue
+        if quoted:
+            out.append("'")
+            quoted = False
+        if out[-1].startswith("$'"):
+            out[-1] = out[-1][:-1]
+        else:
+            out.append("$'")
+        for byte in char.encode("utf-8", "surrogateescape"):
+            name = {7: "a", 8: "b", 9: "t", 10: "n", 11: "v", 12: "f", 13: "r"}.get(byte)
+            out[-1] += "\\" + name if name else "\\{0:03o}".format(byte)
+        out[-1] += "'"
+    if quoted:
+        out.append("'")
+    return "".join(out)
+
+## raised for a conversion printf does not know, with the output before it
+class PrintfError(Exception):
+    def __init__(self, output, spec):
+        super().__init__("{0}: invalid conversion specification".format(spec))
+        self.output = output
+
+## converts a printf argument for a numeric conversion, returning the value
+## and whether it was valid; like coreutils a leading quote gives the code
+## of the character after it
+def printfnumber(arg, conv):
+    if arg[:1] in ("'", "\"") and len(arg) > 1:
+        return ord(arg[1]), True
+    try:
+        if conv in "diouxXc":
+            text = arg.strip()
+            sign = -1 if text.startswith("-") else 1
+            digits = text.lstrip("+-")
+            if digits.lower().startswith("0x"):
+                return sign * int(digits[2:], 16), True
+            if digits.startswith("0") and len(digits) > 1:
+                return sign * int(digits[1:], 8), True
+            return int(text), True
+        return float(arg), True
+    except ValueError:
+        return 0, False
+
+## formats args with fmt the way printf(1) does, reusing the format while
+## arguments remain; returns the output and the arguments that were not
+## valid numbers
+def printf(fmt, args):
+    out = []
+    invalid = []
+    args = list(args)
+    while True:
+        consumed = 0
+        i = 0
+        while i < len(fmt):
+            if fmt[i] != "%":
+                end = fmt.find("%", i)
+                if end < 0:
+                    end = len(fmt)
+                text, stop = unescape(fmt[i:end], format=True)
+                out.append(text)
+                if stop:
+                    return "".join(out), invalid
+                i = end
+                continue
+            if fmt[i + 1:i + 2] == "%":
+                out.append("%")
+                i += 2
+                continue
+
+            ## %[flags][width][.precision]conversion
+            start = i
+            j = i + 1
+            while j < len(fmt) and fmt[j] in "-+ #0'":
+                j += 1
+            flags = fmt[i + 1:j].replace("'", "")
+            spec = ""
+            for part in ("width", "precision"):
+                if part == "precision":
+                    if fmt[j:j + 1] != ".":
+                        break
+                    spec += "."
+                    j += 1
+                if fmt[j:j + 1] == "*":
+                    arg = args[consumed] if consumed < len(args) else "0"
+                    consumed += 1
+                    number, ok = printfnumber(arg, "d")
+                    if not ok:
+                        invalid.append(arg)
+                    spec += str(number)
+                    j += 1
+                else:
+                    digits = j
+                    while j < len(fmt) and fmt[j].isdigit():
+                        j += 1
+                    spec += fmt[digits:j]
+            if j >= len(fmt):
+                out.append(fmt[i:])
+                break
+            conv = fmt[j]
+            i = j + 1
+            arg = args[consumed] if consumed < len(args) else None
+            if conv not in "diouxXfFeEgGaAcsbq" or (conv == "q" and (flags or spec)):
+                raise PrintfError("".join(out), fmt[start:i])
+            consumed += 1
+            if conv == "s":
+                out.append(("%" + flags + spec + "s") % (arg or ""))
+            elif conv == "b":
+                text, stop = unescape(arg or "")
+                out.append(("%" + flags + spec + "s") % text)
+                if stop:
+                    return "".join(out), invalid
+            elif conv == "q":
+                out.append(shellquote(arg or ""))
+            elif conv == "c":
+                out.append(("%" + flags + spec.split(".")[0] + "s") % (arg or "")[:1])
+            else:
+                number, ok = printfnumber(arg or "0", conv)
+                if not ok:
+                    invalid.append(arg)
+                if conv in "diu":
+                    if conv == "u" and number < 0:
+                        number &= 0xffffffffffffffff
+                    out.append(("%" + flags + spec + "d") % number)
+                elif conv in "oxX":
+                    if number < 0:
+                        number &= 0xffffffffffffffff
+                    out.append(("%" + flags + spec + conv) % number)
+                elif conv in "aA":
+                    text = float(number).hex()
+                    out.append(("%" + flags + spec.split(".")[0] + "s") % (text.upper() if conv == "A" else text))
+                else:
+                    out.append(("%" + flags + spec + conv) % number)
+        if consumed == 0 or consumed >= len(args):
+            return "".join(out), invalid
+        args = args[consumed:]
+
+## printf FORMAT [ARGUMENT]...
+@builtin("printf")
+def printfbuiltin(shell, cmd):
+    if not cmd.args:
+        error(shell, "printf: missing operand")
+        return 1
+    try:
+        text, invalid = printf(cmd.args[0], cmd.args[1:])
+    except PrintfError as e:
+        shell.print(e.output)
+        error(shell, "printf: {0}".format(e))
+        return 1
+    shell.print(text)
+    for arg in invalid:
+        error(shell, "printf: '{0}': expected a numeric value".format(arg))
+    if invalid:
+        return 1
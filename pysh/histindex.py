@@ -0,0 +1,125 @@
+#!/usr/bin/python3
+## Copyright 2015 Kevin Boxhoorn
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##   http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+## histindex.py
+##
+## Bash-style history expansion ("!!", "!N", "!-N", "!prefix", "!?text?"
+## and word designators such as ":2", ":$" or "*") through an index over
+## readline's history, which is brought up to date with only the lines added
+## since the last expansion. Prefixes are looked up in a sorted list of the
+## distinct lines and substrings through the positions of their trigrams, so
+## neither walks the whole history.
+
+import re, readline
+from bisect import bisect_left, insort
+
+from pysh.builtins import HistoryEventError
+
+## an event followed by an optional word designator; the ":" may be left out
+## before "^", "$" and "*", and a bare designator refers to the last command
+histexpansion = re.compile(r"""!(?:(?P<last>!)|(?P<number>-?\d+)|\?(?P<substring>[^?]*)\??|(?P<prefix>[^\s:$^*?!=-][^\s:$^*]*)|)
+                               (?::(?P<first>\d+|\^|\$|\*)(?:-(?P<end>\d+|\$))?|(?P<short>[$^*]))?\Z""", re.VERBOSE)
+
+class HistoryIndex:
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        ## the indexed lines, readline's items 1 to len(self.lines)
+        self.lines = []
+        ## distinct lines in sorted order, and the last position of each
+        self.sorted = []
+        self.latest = {}
+        ## positions of the lines holding each trigram, in increasing order
+        self.trigrams = {}
+
+    ## index readline's items up to end, starting again if readline's history
+    ## was cleared or its indexed lines changed
+    def sync(self, end):
+        if end < len(self.lines) or (self.lines and readline.get_history_item(len(self.lines)) != self.lines[-1]):
+            self.clear()
+        for position in range(len(self.lines) + 1, end + 1):
+            self.add(readline.get_history_item(position) or "")
+
+    def add(self, line):
+        self.lines.append(line)
+        position = len(self.lines)
+        if line not in self.latest:
+            insort(self.sorted, line)
+        self.latest[line] = position
+        for trigram in {line[i:i + 3] for i in range(len(line) - 2)}:
+            self.trigrams.setdefault(trigram, []).append(position)
+
+    ## the line at a 1-based position, or counting back from the end when
+    ## negative
+    def number(self, number):
+        position = number if number > 0 else len(self.lines) + 1 + number
+        if not 0 < position <= len(self.lines):
+            return None
+        return self.lines[position - 1]
+
+    ## the latest line starting with prefix
+    def prefix(self, prefix):
+        best = 0
+        for i in range(bisect_left(self.sorted, prefix), len(self.sorted)):
+            if not self.sorted[i].startswith(prefix):
+                break
+            best = max(best, self.latest[self.sorted[i]])
+        return self.lines[best - 1] if best else None
+
+    ## the latest line holding text, found by checking the lines with the
+    ## rarest of its trigrams from the newest; shorter text is looked for
+    ## line by line
+    def substring(self, text):
+        positions = range(1, len(self.lines) + 1)
+        for trigram in {text[i:i + 3] for i in range(len(text) - 2)}:
+            candidates = self.trigrams.get(trigram, ())
+            if len(candidates) < len(positions):
+                positions = candidates
+        for position in reversed(positions):
+            if text in self.lines[position - 1]:
+                return self.lines[position - 1]
+        return None
+
+    ## the line event refers to, with its designated words
+    def expand(self, event):
+        match = histexpansion.match(event)
+        if match is None:
+            raise HistoryEventError(event, "bad event")
+        if match["number"] is not None:
+            line = self.number(int(match["number"]))
+        elif match["substring"] is not None:
+            if not match["substring"]:
+                raise HistoryEventError(event, "no search string")
+            line = self.substring(match["substring"])
+        elif match["prefix"] is not None:
+            line = self.prefix(match["prefix"])
+        else:
+            line = self.number(-1)
+        if line is None:
+            raise HistoryEventError(event, "event not found")
+        first = match["first"] or match["short"]
+        if first is None:
+            return line
+        words = line.split()
+        if first == "*":
+            return " ".join(words[1:])
+        first = {"^": 1, "$": len(words) - 1}.get(first, first)
+        end = {None: first, "$": len(words) - 1}.get(match["end"], match["end"])
+        if not 0 <= int(first) <= int(end) < len(words):
+            raise HistoryEventError(event, "bad word specifier")
+        return " ".join(words[int(first):int(end) + 1])
+
+histindex = HistoryIndex()
@@ -0,0 +1,269 @@
+#!/usr/bin/python3
+## Copyright 2015 Kevin Boxhoorn
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##   http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+## history.py
+##
+## Command history kept in an sqlite database in WAL mode. Every command is
+## appended, and committed, as it finishes, with when and where it ran, how
+## long it took and its exit status, so a crash loses nothing and starting
+## the shell only reads the most recent entries into readline.
+##
+## Any number of sessions share the database: sqlite serializes their
+## appends with fcntl locks on the database and its WAL, and each session
+## merges the commands the others append while it runs into its readline
+## history, reading only the entries added since it last looked.
+##
+## Searches go through the distinct lines, kept up to date by a trigger as
+## entries are appended, in an FTS5 trigram index where sqlite has one, so a
+## search only touches the lines that can match.
+
+import os, queue, readline, sqlite3, sys, threading
+
+from pysh.builtins import PYSH_HISTFILE, PYSH_HISTSEARCH_SIZE
+
+## version of the database layout, kept in "PRAGMA user_version"
+HISTORY_SCHEMA = 4
+## recent lines scored against a query when no line holds all its words
+HISTORY_SIMILAR_CANDIDATES = 200
+## longest wait between merges after repeated errors, in merge intervals
+HISTORY_MERGE_BACKOFF = 32
+
+class HistoryStore:
+    def __init__(self, path):
+        self.path = path
+        ## tells this session's entries apart from those of other sessions
+        self.session = int.from_bytes(os.urandom(6), "big")
+        self.merged = queue.SimpleQueue()
+        self.stopped = threading.Event()
+        self.merger = None
+        self.db = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode = WAL")
+        ## a commit in WAL mode survives the shell crashing; NORMAL only
+        ## risks the last commands if the whole machine goes down
+        self.db.execute("PRAGMA synchronous = NORMAL")
+        self.db.execute("PRAGMA busy_timeout = 5000")
+        if self.db.execute("PRAGMA user_version").fetchone()[0] < HISTORY_SCHEMA:
+            self.upgrade()
+        ## the last entry this session has seen, merged or its own
+        self.seen = self.db.execute("SELECT MAX(id) FROM history").fetchone()[0] or 0
+        self.indexed = self.db.execute("SELECT 1 FROM sqlite_master WHERE name = 'linetrigrams'").fetchone() is not None
+
+    ## create the database or bring an older one up to HISTORY_SCHEMA
+    def upgrade(self):
+        with self.db:
+            self.db.execute("BEGIN IMMEDIATE")
+            version = self.db.execute("PRAGMA user_version").fetchone()[0]
+            if version < 1:
+                self.db.execute("CREATE TABLE IF NOT EXISTS history ("
+                                "id INTEGER PRIMARY KEY, line TEXT NOT NULL, start REAL, "
+                                "cwd TEXT, duration REAL, status INTEGER)")
+                ## carry over the flat readline history file of older versions
+                if self.db.execute("SELECT COUNT(*) FROM history").fetchone()[0] == 0 and os.path.exists(PYSH_HISTFILE):
+                    with open(PYSH_HISTFILE, errors="replace") as f:
+                        self.db.executemany("INSERT INTO history (line) VALUES (?)",
+                                            ((line.rstrip("\n"),) for line in f if line.strip()))
+            if version < 2:
+                self.db.execute("ALTER TABLE history ADD COLUMN session INTEGER")
+            if version < 3:
+                ## each distinct line with the id of its latest entry
+                self.db.execute("CREATE TABLE lines (line TEXT PRIMARY KEY, last INTEGER NOT NULL) WITHOUT ROWID")
+                self.db.execute("CREATE INDEX lines_last ON lines (last)")
+                self.db.execute("INSERT INTO lines (line, last) SELECT line, MAX(id) FROM history GROUP BY line")
+                ## the trigram index holds each distinct line under the id of
+                ## its latest entry, so it can return matches most recent
+                ## first and stop at the limit. The tokenizer needs sqlite
+                ## 3.34; without it, searches scan the distinct lines instead
+                try:
+                    self.db.execute("CREATE VIRTUAL TABLE linetrigrams USING fts5 (line, tokenize='trigram')")
+                except sqlite3.OperationalError:
+                    self.db.execute("CREATE TRIGGER history_lines AFTER INSERT ON history BEGIN "
+                                    "INSERT INTO lines (line, last) VALUES (new.line, new.id) "
+                                    "ON CONFLICT (line) DO UPDATE SET last = new.id; END")
+                else:
+                    self.db.execute("INSERT INTO linetrigrams (rowid, line) SELECT last, line FROM lines")
+                    self.db.execute("CREATE TRIGGER history_lines AFTER INSERT ON history BEGIN "
+                                    "DELETE FROM linetrigrams WHERE rowid = (SELECT last FROM lines WHERE line = new.line); "
+                                    "INSERT INTO lines (line, last) VALUES (new.line, new.id) "
+                                    "ON CONFLICT (line) DO UPDATE SET last = new.id; "
+                                    "INSERT INTO linetrigrams (rowid, line) VALUES (new.id, new.line); END")
+            if version < 4:
+                ## ids are never reused, even after "!-" empties the table,
+                ## since other sessions merge the entries after the last id
+                ## they saw; sqlite cannot add AUTOINCREMENT to a column, so
+                ## the table is copied, which drops its trigger
+                trigger = self.db.execute("SELECT sql FROM sqlite_master WHERE name = 'history_lines'").fetchone()[0]
+                self.db.execute("CREATE TABLE newhistory ("
+                                "id INTEGER PRIMARY KEY AUTOINCREMENT, line TEXT NOT NULL, start REAL, "
+                                "cwd TEXT, duration REAL, status INTEGER, session INTEGER)")
+                self.db.execute("INSERT INTO newhistory (id, line, start, cwd, duration, status, session) "
+                                "SELECT id, line, start, cwd, duration, status, session FROM history")
+                self.db.execute("DROP TABLE history")
+                self.db.execute("ALTER TABLE newhistory RENAME TO history")
+                self.db.execute(trigger)
+            self.db.execute("PRAGMA user_version = {0}".format(HISTORY_SCHEMA))
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM history").fetchone()[0]
+
+    ## append an entry for this session, returning its id
+    def add(self, line, start=None, cwd=None, duration=None, status=None):
+        return self.db.execute("INSERT INTO history (line, start, cwd, duration, status, session) VALUES (?, ?, ?, ?, ?, ?)",
+                               (line, start, cwd, duration, status, self.session)).lastrowid
+
+    ## add many (line, start, cwd, duration, status) entries in one transaction
+    def extend(self, entries):
+        with self.db:
+            self.db.execute("BEGIN")
+            self.db.executemany("INSERT INTO history (line, start, cwd, duration, status) VALUES (?, ?, ?, ?, ?)", entries)
+
+    ## the last count entries as (id, line, start, cwd, duration, status),
+    ## oldest first
+    def recent(self, count):
+        rows = self.db.execute("SELECT id, line, start, cwd, duration, status FROM history "
+                               "ORDER BY id DESC LIMIT ?", (count,)).fetchall()
+        rows.reverse()
+        return rows
+
+    def get(self, ident):
+        return self.db.execute("SELECT id, line, start, cwd, duration, status FROM history WHERE id = ?",
+                               (ident,)).fetchone()
+
+    ## fill readline's history with the last count lines
+    def load(self, count):
+        for _, line, *_ in self.recent(count):
+            readline.add_history(line)
+
+    ## look for other sessions' entries every interval seconds on a thread
+    ## with its own connection, queueing them for merge()
+    def startmerging(self, interval):
+        if self.merger is None:
+            self.merger = threading.Thread(target=self.mergeloop, args=(interval,), name="pysh-history", daemon=True)
+            self.merger.start()
+
+    ## an error (e.g. the database locked for longer than the busy timeout,
+    ## or its file replaced) is reported once and the merge retried on a new
+    ## connection, waiting twice as long after each failure up to
+    ## HISTORY_MERGE_BACKOFF intervals
+    def mergeloop(self, interval):
+        db = None
+        version = None
+        delay = interval
+        error = None
+        while not self.stopped.wait(delay):
+            try:
+                if db is None:
+                    db = sqlite3.connect(self.path, isolation_level=None)
+                    db.execute("PRAGMA busy_timeout = 5000")
+                    version = None
+                ## changes whenever another connection commits, so an idle
+                ## database costs one pragma per interval
+                changed = db.execute("PRAGMA data_version").fetchone()[0]
+                if changed != version:
+                    version = changed
+                    for ident, line, session in db.execute("SELECT id, line, session FROM history WHERE id > ? ORDER BY id", (self.seen,)):
+                        if session != self.session:
+                            self.merged.put(line)
+                        self.seen = ident
+                delay = interval
+                error = None
+            except sqlite3.Error as e:
+                if str(e) != error:
+                    error = str(e)
+                    sys.stderr.write("history: merging other sessions failed: {0}\n".format(e))
+                    sys.stderr.flush()
+                if db is not None:
+                    db.close()
+                    db = None
+                delay = min(delay * 2, interval * HISTORY_MERGE_BACKOFF)
+        if db is not None:
+            db.close()
+
+    ## add the entries other sessions appended since the last merge to
+    ## readline; readline is only touched from the thread reading input
+    def merge(self):
+        while True:
+            try:
+                readline.add_history(self.merged.get_nowait())
+            except queue.Empty:
+                return
+
+    ## up to limit distinct lines matching query, best first: lines holding
+    ## the query, then lines holding each of its words, most recent first.
+    ## Only if no line holds every word are the lines most like the query
+    ## returned instead, to get past typos. Matching ignores ASCII case
+    def search(self, query, limit=PYSH_HISTSEARCH_SIZE):
+        words = query.split()
+        if not words:
+            return [line for line, in self.db.execute("SELECT line FROM lines ORDER BY last DESC LIMIT ?", (limit,))]
+        results = []
+        for substrings in ([query.strip()], words)[len(words) == 1:]:
+            sql, params = self.substrings(substrings)
+            for line, in self.db.execute(sql, params + [limit]):
+                if line not in results:
+                    results.append(line)
+            if len(results) >= limit:
+                return results[:limit]
+        if not results and self.indexed:
+            results = self.similar(query.strip(), limit)
+        return results
+
+    ## a query for the lines holding all of substrings, through the trigram
+    ## index for those of at least three characters
+    def substrings(self, substrings):
+        where = []
+        params = []
+        long = [s for s in substrings if len(s) >= 3]
+        if self.indexed and long:
+            where.append("linetrigrams MATCH ?")
+            params.append(" AND ".join(phrase(s) for s in long))
+        for s in substrings:
+            if not self.indexed or s not in long:
+                where.append("line LIKE ? ESCAPE '\\'")
+                params.append("%" + s.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%")
+        if self.indexed:
+            return "SELECT line FROM linetrigrams WHERE {0} ORDER BY rowid DESC LIMIT ?".format(" AND ".join(where)), params
+        return "SELECT line FROM lines WHERE {0} ORDER BY last DESC LIMIT ?".format(" AND ".join(where)), params
+
+    ## the lines sharing the most trigrams with text, which gets past typos
+    ## in longer queries. Only the most recent lines sharing any trigram are
+    ## scored, so this stays as fast as a search however common they are
+    def similar(self, text, limit):
+        trigrams = {text[i:i + 3].lower() for i in range(len(text) - 2)}
+        if not trigrams:
+            return []
+        candidates = self.db.execute("SELECT line FROM linetrigrams WHERE linetrigrams MATCH ? ORDER BY rowid DESC LIMIT ?",
+                                     (" OR ".join(phrase(t) for t in sorted(trigrams)), HISTORY_SIMILAR_CANDIDATES))
+        scored = []
+        for rank, (line,) in enumerate(candidates):
+            lower = line.lower()
+            scored.append((-sum(1 for t in trigrams if t in lower), rank, line))
+        scored.sort()
+        return [line for *_, line in scored[:limit]]
+
+    def clear(self):
+        self.db.execute("DELETE FROM history")
+        self.db.execute("DELETE FROM lines")
+        if self.indexed:
+            self.db.execute("DELETE FROM linetrigrams")
+
+    def close(self):
+        self.stopped.set()
+        if self.merger is not None:
+            self.merger.join()
+        self.db.close()
+
+## an FTS5 string literal matching text exactly
+def phrase(text):
+    return "\"" + text.replace("\"", "\"\"") + "\""
@@ -0,0 +1,314 @@
+#!/usr/bin/python3
+## Copyright 2015 Kevin Boxhoorn
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##   http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+## jobs.py
+##
+## Background jobs, run as child processes in their own process group. One
+## thread, running an asyncio event loop, reaps their processes and collects
+## their output.
+
+import os, signal, zlib
+from tempfile import TemporaryFile
+from threading import Event, Lock, Thread
+
+from pysh.spawn import exitstatus
+from pysh.trace import tracer
+
+## tracks every background job from one thread running an asyncio event
+## loop: each process is watched through a reader callback on its pidfd (or
+## a SIGCHLD handler where pidfds are unavailable), and each output pipe
+## through a reader callback that drains it. All job bookkeeping runs on the
+## loop, which is only started, with asyncio imported, by the first job
+class JobLoop:
+    def __init__(self):
+        self.lock = Lock()
+        self.loop = None
+        self.children = {}
+
+    def getloop(self):
+        with self.lock:
+            if self.loop is None:
+                import asyncio
+                self.loop = asyncio.new_event_loop()
+                Thread(target=self.loop.run_forever, name="pysh-jobs", daemon=True).start()
+        return self.loop
+
+    ## call handler(fd) on the loop whenever fd is readable
+    def register(self, fd, handler):
+        loop = self.getloop()
+        loop.call_soon_threadsafe(loop.add_reader, fd, handler, fd)
+
+    ## only called on the loop
+    def unregister(self, fd):
+        self.loop.remove_reader(fd)
+        os.close(fd)
+
+    ## call callback(pid, status) on the loop once pid has exited
+    def watch(self, pid, callback):
+        if not hasattr(os, "pidfd_open"):
+            self.getloop()
+            if not self.children:
+                signal.signal(signal.SIGCHLD, self.sigchld)
+            self.children[pid] = callback
+            self.sigchld()
+            return
+
+        def reap(fd):
+            self.unregister(fd)
+            _, status = os.waitpid(pid, 0)
+            callback(pid, exitstatus(status))
+        self.register(os.pidfd_open(pid), reap)
+
+    ## only runs in the main thread, so the children are not locked
+    def sigchld(self, signum=None, frame=None):
+        for pid, callback in list(self.children.items()):
+            try:
+                reaped, status = os.waitpid(pid, os.WNOHANG)
+            except ChildProcessError:
+                continue
+            if reaped:
+                del self.children[pid]
+                self.loop.call_soon_threadsafe(callback, pid, exitstatus(status))
+
+    ## read everything written to the pipe fd into output, then call callback
+    def drain(self, fd, output, callback):
+        def read(fd):
+            data = os.read(fd, 65536)
+            if data:
+                output.write(data)
+            else:
+                self.unregister(fd)
+                callback()
+        self.register(fd, read)
+
+jobloop = JobLoop()
+
+## the output of a job. The most recent bytes are kept in a bounded buffer
+## in memory; when it grows past its size, the older half is compressed with
+## zlib and appended to a temporary file as a segment. Offsets are positions
+## in the whole output, and bytes are only decoded by whoever displays them
+class JobOutput:
+    def __init__(self, size):
+        self.size = size
+        self.lock = Lock()
+        self.buffer = bytearray()
+        self.start = 0
+        self.segments = []
+        self.file = None
+        self.fileend = 0
+
+    def __len__(self):
+        return self.start + len(self.buffer)
+
+    def write(self, data):
+        with self.lock:
+            self.buffer += data
+            if len(self.buffer) > self.size:
+                self.spill(len(self.buffer) - self.size // 2)
+
+    ## move the first count bytes of the buffer to a segment on disk
+    def spill(self, count):
+        if self.file is None:
+            self.file = TemporaryFile(prefix="pysh-job-")
+        data = zlib.compress(self.buffer[:count], 1)
+        os.pwrite(self.file.fileno(), data, self.fileend)
+        self.segments.append((self.start, count, self.fileend, len(data)))
+        self.fileend += len(data)
+        self.start += count
+        del self.buffer[:count]
+
+    ## the bytes of the segment or buffer holding offset, and its first offset
+    def piece(self, offset):
+        with self.lock:
+            if offset >= self.start:
+                return self.start, bytes(self.buffer)
+            for start, length, fileoffset, filelength in self.segments:
+                if offset < start + length:
+                    return start, zlib.decompress(os.pread(self.file.fileno(), filelength, fileoffset))
+        return offset, b""
+
+    ## yield the bytes from offset start to end, one piece at a time
+    def chunks(self, start=0, end=None):
+        while end is None or start < end:
+            offset, data = self.piece(start)
+            data = data[start - offset:] if end is None else data[start - offset:end - offset]
+            if not data:
+                return
+            yield data
+            start += len(data)
+
+    ## the offset just past the first n lines
+    def headoffset(self, n):
+        offset = 0
+        for data in self.chunks():
+            pos = -1
+            while n > 0:
+                pos = data.find(b"\n", pos + 1)
+                if pos < 0:
+                    break
+                n -= 1
+            if n == 0:
+                return offset + pos + 1
+            offset += len(data)
+        return offset
+
+    ## the offset at which the last n lines start
+    def tailoffset(self, n):
+        end = len(self)
+        if end == 0:
+            return 0
+        ## a final newline ends the last line rather than starting a new one
+        if self.piece(end - 1)[1][-1:] == b"\n":
+            n += 1
+        while end > 0:
+            offset, data = self.piece(end - 1)
+            pos = end - offset
+            while n > 0:
+                pos = data.rfind(b"\n", 0, pos)
+                if pos < 0:
+                    break
+                n -= 1
+            if n == 0:
+                return offset + pos + 1
+            end = offset
+        return 0
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+## a command line running in the background: its processes share a process
+## group led by the first, and their output is collected on the job loop.
+## Embedding code can wait for a job from its own event loop with "await job"
+class Job:
+    def __init__(self, cmd, buffersize):
+        self.cmd = cmd
+        self.pids = []
+        self.lastpid = None
+        self.pgid = None
+        self.status = None
+        ## one for each process and the output pipe, plus one until started
+        self.remaining = 1
+        self.done = Event()
+        self.callbacks = []
+        self.notified = False
+        self.output = JobOutput(buffersize)
+        ## builtin stages run on threads, and an event they can watch to
+        ## stop early when the job is killed
+        self.threads = 0
+        self.cancelled = Event()
+        tracer.begin("job", id(self), cmd=cmd)
+
+    def __str__(self):
+        if self.running:
+            return "running {0}".format(self.cmd)
+        return "done ({0}) {1}".format(self.status, self.cmd)
+
+    def __await__(self):
+        import asyncio
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        def wake():
+            if not future.done():
+                future.set_result(self.status)
+        self.ondone(lambda: loop.call_soon_threadsafe(wake))
+        return future.__await__()
+
+    @property
+    def running(self):
+        return not self.done.is_set()
+
+    ## read the job's output from the pipe fd; this must be done before
+    ## anything is written to it, as the job could fill the pipe
+    def collect(self, fd):
+        self.remaining += 1
+        jobloop.drain(fd, self.output, self.finished)
+
+    ## record the processes started for the job and wait for them to exit
+    def start(self, pids):
+        self.pids = pids
+        if pids:
+            self.pgid = pids[0]
+        jobloop.getloop().call_soon_threadsafe(self.started, len(pids))
+        for pid in pids:
+            jobloop.watch(pid, self.reaped)
+
+    def started(self, count):
+        self.remaining += count
+        self.finished()
+
+    def reaped(self, pid, status):
+        if pid == self.lastpid:
+            self.status = status
+        self.finished()
+
+    ## run target() on a thread as part of the job (a builtin stage of its
+    ## pipeline); its result is the job's status if it is the last stage
+    def runthread(self, target, last):
+        self.threads += 1
+        loop = jobloop.getloop()
+        loop.call_soon_threadsafe(self.added)
+        def run():
+            status = None
+            try:
+                status = target()
+            finally:
+                loop.call_soon_threadsafe(self.threadfinished, status, last)
+        Thread(target=run, name="pysh-builtin", daemon=True).start()
+
+    def added(self):
+        self.remaining += 1
+
+    def threadfinished(self, status, last):
+        if last:
+            self.status = status
+        self.finished()
+
+    ## the job is done once every process has exited and its output is read
+    def finished(self):
+        self.remaining -= 1
+        if self.remaining == 0:
+            tracer.end("job", id(self), status=self.status, pids=self.pids, output=len(self.output))
+            with jobloop.lock:
+                self.done.set()
+                callbacks, self.callbacks = self.callbacks, []
+            for callback in callbacks:
+                callback()
+
+    ## call callback() once the job is done, from the job loop if it is not
+    ## done yet
+    def ondone(self, callback):
+        with jobloop.lock:
+            if self.running:
+                self.callbacks.append(callback)
+                return
+        callback()
+
+    def wait(self):
+        self.done.wait()
+        return self.status
+
+    ## signal every process of the job and cancel its builtin stages
+    def kill(self, sig=signal.SIGKILL):
+        self.cancelled.set()
+        if self.pgid is not None and self.running:
+            try:
+                os.killpg(self.pgid, sig)
+            except ProcessLookupError:
+                pass
+
+    ## release the job's output once it is no longer needed
+    def discard(self):
+        self.output.close()
@@ -17,13 +17,15 @@
 ##
 ## Tokenizing of PySH commands.
 
-from os.path import expanduser, expandvars
+from hashlib import md5
+from os.path import dirname
 
 import ply.lex as lex
+from pysh.cache import cachefile, cachemodule
 
 tokens = (
     "COMMAND",
-    "COMMENT",
+    "DUPFD",
     "FILENAME",
     "HISTCMD",
     "JOB",
@@ -31,33 +33,57 @@ tokens = (
     "NUMBER",
     "OPTIONS",
     "PATHNAME",
+    "PIPE",
+    "REDIRECT",
     "VAR",
     "VARASSIGN"
 )
 
-t_COMMAND = r"[A-Za-z0-9_+-]+"
-t_FILENAME = r"\w+\.\w+"
-t_HISTCMD = r"\!(?:\!|-?\d+|-)"
+## "[", "=", "%" and "\\" are word characters for the arguments of test and printf
+t_COMMAND = r"[A-Za-z0-9_+:{}\[\]=%,\\-]+"
+## history events ("!!", "!N", "!-N", "!prefix", "!?text?") with an optional
+## word designator (":N", ":N-M", ":^", ":$", ":*" or "$", "^", "*" alone)
+t_HISTCMD = r"\!(?:\!|-?\d+|\?[^?\s]*\??|[^\s:$^*?!=|&<>-][^\s:$^*|&<>]*|-|=)?(?::(?:\d+|[$^*])(?:-(?:\d+|\$))?|[$^*])?"
 t_JOB = r"&"
 t_JOBIDENT = r"j\d+"
 t_NUMBER = r"\d+"
 t_OPTIONS = r"-{1,2}\w+"
+t_PIPE = r"\|"
 t_VARASSIGN = r"\w+=\w+"
 
-def t_PATHNAME(t):
-    r"(?:\~|\.{1,2})?(?:\/[A-Za-z0-9.\-_]*)+"
-    t.value = expanduser(t.value)
+## "~" and "$VAR" are left unexpanded here and expanded when the command is
+## built (see Word.expand), so parsed lines stay valid if the environment changes
+t_PATHNAME = r"(?:\~|\.{1,2})?(?:\/[A-Za-z0-9.\-_:{}]*)+"
+t_VAR = r"\$(?:\w+|\?)"
+
+## rules defined as functions are matched before the strings above, so
+## "2>&1", "2>" and "a.txt" are not split up by COMMAND and JOB
+def t_DUPFD(t):
+    r"[0-9]*>&[0-9]+"
+    return t
+def t_REDIRECT(t):
+    r"[0-9]*(?:>>|>|<)|&>>?"
     return t
-def t_VAR(t):
-    r"\$\w+"
-    t.value = expandvars(t.value)
+def t_FILENAME(t):
+    r"[\w+:{}-]+(?:\.[\w+:{}-]*)+"
     return t
 
 def t_error(t):
     print("error: cannot parse character \"{0}\"".format(t.value[0]))
+    t.lexer.errors += 1
     t.lexer.skip(1)
 
 t_ignore = " \t\n"
 t_ignore_COMMENT = r"\#.*"
 
-lexer = lex.lex()
+## the master regex is written to the cache directory once and trusted from
+## then on; the table name is keyed by the contents of this file, so editing
+## any rule produces a new table
+with open(__file__, "rb") as f:
+    lextab = "lextab_" + md5(f.read()).hexdigest()
+lextabfile = cachefile(lextab + ".py")
+if lextabfile:
+    lexer = lex.lex(optimize=True, lextab=cachemodule(lextab) or lextab, outputdir=dirname(lextabfile))
+else:
+    lexer = lex.lex()
+lexer.errors = 0
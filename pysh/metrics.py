@@ -0,0 +1,292 @@
+#!/usr/bin/python3
+## Copyright 2015 Kevin Boxhoorn
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##   http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+## metrics.py
+##
+## Counters, gauges and latency histograms for the commands a shell runs,
+## shown by the "stats" builtin and optionally served in the Prometheus text
+## format on a unix socket. A "+=" is not atomic under the GIL, and metrics
+## are updated from job threads as well as the main thread, so each update
+## holds the metric's lock.
+
+import atexit, os, socket, struct, threading, time
+
+## sub-buckets per power of two in a histogram, giving values to within 1/16
+## (about 6%) of what was recorded whatever their magnitude
+HISTOGRAM_BITS = 4
+HISTOGRAM_SUBBUCKETS = 1 << HISTOGRAM_BITS
+
+## upper bounds in nanoseconds of the buckets exported to Prometheus: powers
+## of two from about 1µs to about 1 minute
+EXPORT_BOUNDS = [1 << n for n in range(10, 37)]
+
+class Counter:
+    __slots__ = ("name", "help", "value", "lock")
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, n=1):
+        with self.lock:
+            self.value += n
+
+    def reset(self):
+        with self.lock:
+            self.value = 0
+
+    def report(self):
+        return [(self.name, str(self.value))]
+
+    def prometheus(self):
+        return ["# HELP {0} {1}".format(self.name, self.help),
+                "# TYPE {0} counter".format(self.name),
+                "{0} {1}".format(self.name, self.value)]
+
+## a value that goes up and down, or is read from func when it is given
+class Gauge(Counter):
+    __slots__ = ("func",)
+
+    def __init__(self, name, help, func=None):
+        super().__init__(name, help)
+        self.func = func
+
+    def dec(self, n=1):
+        with self.lock:
+            self.value -= n
+
+    def get(self):
+        return self.value if self.func is None else self.func()
+
+    def reset(self):
+        pass
+
+    def report(self):
+        return [(self.name, str(self.get()))]
+
+    def prometheus(self):
+        return ["# HELP {0} {1}".format(self.name, self.help),
+                "# TYPE {0} gauge".format(self.name),
+                "{0} {1}".format(self.name, self.get())]
+
+## a log-linear histogram of durations in nanoseconds, in the manner of
+## HdrHistogram: each power of two is split into HISTOGRAM_SUBBUCKETS
+## buckets, so the counts stay small while the relative error is bounded.
+## A bucket holds the values above its lower bound up to its upper bound, as
+## Prometheus buckets do, so a value is bucketed by the one below it
+class Histogram:
+    __slots__ = ("name", "help", "counts", "count", "sum", "max", "lock")
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.counts = [0] * (2 * HISTOGRAM_SUBBUCKETS)
+            self.count = 0
+            self.sum = 0
+            self.max = 0
+
+    def record(self, value):
+        below = max(value - 1, 0)
+        shift = below.bit_length() - HISTOGRAM_BITS - 1
+        if shift <= 0:
+            index = below
+        else:
+            index = shift * HISTOGRAM_SUBBUCKETS + (below >> shift)
+        with self.lock:
+            if index >= len(self.counts):
+                self.counts.extend([0] * (index + 1 - len(self.counts)))
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+            if value > self.max:
+                self.max = value
+
+    ## the value below the lowest value of a bucket and its highest value
+    @staticmethod
+    def bounds(index):
+        if index < 2 * HISTOGRAM_SUBBUCKETS:
+            return index, index + 1
+        shift = index // HISTOGRAM_SUBBUCKETS - 1
+        low = (index - shift * HISTOGRAM_SUBBUCKETS) << shift
+        return low, low + (1 << shift)
+
+    ## the value below which fraction q of the recorded values fall, as the
+    ## middle of the bucket holding it
+    def percentile(self, q):
+        if self.count == 0:
+            return 0
+        rank = max(1, round(q * self.count))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                low, high = self.bounds(index)
+                return min((low + 1 + high) // 2, self.max)
+        return self.max
+
+    ## the number of values at most each bound, which must be powers of two
+    ## so they fall on bucket edges
+    def cumulative(self, bounds):
+        result = []
+        seen = 0
+        index = 0
+        for bound in bounds:
+            while index < len(self.counts) and self.bounds(index)[1] <= bound:
+                seen += self.counts[index]
+                index += 1
+            result.append(seen)
+        return result
+
+    def report(self):
+        if self.count == 0:
+            return [(self.name, "0")]
+        return [(self.name, "{0} mean {1} p50 {2} p90 {3} p99 {4} max {5}".format(
+            self.count, formatns(self.sum // self.count), formatns(self.percentile(0.5)),
+            formatns(self.percentile(0.9)), formatns(self.percentile(0.99)), formatns(self.max)))]
+
+    def prometheus(self):
+        lines = ["# HELP {0} {1}".format(self.name, self.help),
+                 "# TYPE {0} histogram".format(self.name)]
+        for bound, count in zip(EXPORT_BOUNDS, self.cumulative(EXPORT_BOUNDS)):
+            lines.append("{0}_bucket{{le=\"{1:g}\"}} {2}".format(self.name, bound / 1e9, count))
+        lines.append("{0}_bucket{{le=\"+Inf\"}} {1}".format(self.name, self.count))
+        lines.append("{0}_sum {1:g}".format(self.name, self.sum / 1e9))
+        lines.append("{0}_count {1}".format(self.name, self.count))
+        return lines
+
+def formatns(ns):
+    if ns < 1000:
+        return "{0}ns".format(ns)
+    if ns < 1000000:
+        return "{0:.1f}µs".format(ns / 1e3)
+    if ns < 1000000000:
+        return "{0:.1f}ms".format(ns / 1e6)
+    return "{0:.2f}s".format(ns / 1e9)
+
+class Metrics:
+    def __init__(self):
+        self.items = []
+        self.started = time.monotonic()
+        self.server = None
+
+    def counter(self, name, help):
+        return self.add(Counter(name, help))
+    def gauge(self, name, help, func=None):
+        return self.add(Gauge(name, help, func))
+    def histogram(self, name, help):
+        return self.add(Histogram(name, help))
+
+    def add(self, item):
+        self.items.append(item)
+        return item
+
+    def reset(self):
+        self.started = time.monotonic()
+        for item in self.items:
+            item.reset()
+
+    def uptime(self):
+        return time.monotonic() - self.started
+
+    ## "name value" lines for the stats builtin, counters followed by their
+    ## rate per second since the metrics were started or reset
+    def report(self):
+        uptime = self.uptime()
+        rows = [("pysh_uptime_seconds", "{0:.1f}".format(uptime))]
+        for item in self.items:
+            for name, value in item.report():
+                if type(item) is Counter and uptime > 0:
+                    value = "{0} ({1:.2f}/s)".format(value, item.value / uptime)
+                rows.append((name, value))
+        width = max(len(name) for name, _ in rows)
+        return "".join("{0:<{1}}  {2}\n".format(name, width, value) for name, value in rows)
+
+    def prometheus(self):
+        lines = ["# HELP pysh_uptime_seconds Seconds since the metrics were started or reset.",
+                 "# TYPE pysh_uptime_seconds gauge",
+                 "pysh_uptime_seconds {0:.3f}".format(self.uptime())]
+        for item in self.items:
+            lines.extend(item.prometheus())
+        return "\n".join(lines) + "\n"
+
+    ## serve the metrics on a unix socket from a daemon thread. A connection
+    ## sending an HTTP request gets an HTTP response, so Prometheus can scrape
+    ## through a unix socket proxy; any other connection gets the bare text
+    def serve(self, path):
+        if self.server is not None:
+            raise ValueError("metrics already served on {0}".format(self.server.getsockname()))
+        if os.path.exists(path):
+            os.unlink(path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        umask = os.umask(0o077)
+        try:
+            server.bind(path)
+        finally:
+            os.umask(umask)
+        server.listen(16)
+        self.server = server
+        atexit.register(self.stopserving)
+        threading.Thread(target=self.accept, args=(server,), name="pysh-metrics", daemon=True).start()
+
+    def accept(self, server):
+        while True:
+            try:
+                conn, _ = server.accept()
+            except OSError:
+                return
+            with conn:
+                uid = struct.unpack("3i", conn.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i")))[1]
+                if uid != os.getuid():
+                    continue
+                try:
+                    self.respond(conn)
+                except OSError:
+                    pass
+
+    def respond(self, conn):
+        conn.settimeout(0.2)
+        try:
+            request = conn.recv(4096)
+        except socket.timeout:
+            request = b""
+        body = self.prometheus().encode()
+        if request.startswith((b"GET ", b"HEAD ")):
+            header = ("HTTP/1.0 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                      "Content-Length: {0}\r\n\r\n").format(len(body)).encode()
+            body = header if request.startswith(b"HEAD ") else header + body
+        conn.sendall(body)
+
+    def stopserving(self):
+        if self.server is not None:
+            path = self.server.getsockname()
+            ## closing alone does not wake a thread blocked in accept() on
+            ## Linux, so the socket is shut down first
+            try:
+                self.server.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self.server.close()
+            self.server = None
+            if os.path.exists(path):
+                os.unlink(path)
+
+metrics = Metrics()
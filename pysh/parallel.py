@@ -0,0 +1,170 @@
+#!/usr/bin/python3
+## Copyright 2015 Kevin Boxhoorn
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##   http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+## parallel.py
+##
+## The "parallel" builtin: runs a command once per input on a bounded pool of
+## child processes, in the style of GNU parallel.
+
+import os, selectors, signal, time
+from os.path import splitext
+from tempfile import TemporaryFile
+
+## a command started for one input; its output is kept in a temporary file
+## until it can be written out whole, so the outputs of tasks never mix
+class Task:
+    __slots__ = ("seq", "cmd", "pid", "out", "start", "started", "status")
+
+    def __init__(self, seq, cmd):
+        self.seq = seq
+        self.cmd = cmd
+        self.pid = None
+        self.out = TemporaryFile(prefix="pysh-parallel-")
+        self.start = time.time()
+        self.started = time.perf_counter()
+        self.status = None
+
+## runs template once per input with at most jobs tasks at a time. "{}" in
+## the template is replaced by the input and "{.}" by the input without its
+## extension; without either the input is appended. Inputs are only taken
+## from their iterator as tasks finish, so a long input file is not read
+## ahead of the pool. Outputs are written as tasks finish, or in input order
+## if keeporder is set, and a joblog file, if given, gets a line per task
+class Parallel:
+    def __init__(self, shell, template, jobs, keeporder=False, joblog=None):
+        self.shell = shell
+        self.template = template
+        self.jobs = jobs
+        self.keeporder = keeporder
+        self.joblog = joblog
+        self.running = {}
+        self.finished = {}
+        self.next = 1
+        self.failed = 0
+        self.selector = selectors.DefaultSelector() if hasattr(os, "pidfd_open") else None
+
+    def command(self, arg):
+        cmd = type(self.template)()
+        substituted = False
+        for word in self.template:
+            if "{}" in word or "{.}" in word:
+                word = word.replace("{.}", splitext(arg)[0]).replace("{}", arg)
+                substituted = True
+            cmd.append(word)
+        if not substituted:
+            cmd.append(arg)
+        return cmd
+
+    ## run a task for each input and return the number that failed
+    def run(self, inputs):
+        inputs = iter(inputs)
+        seq = 0
+        if self.joblog:
+            self.joblog.write("Seq\tStarttime\tJobRuntime\tExitval\tSignal\tCommand\n")
+        with open(os.devnull, "rb") as devnull:
+            try:
+                while True:
+                    while len(self.running) < self.jobs:
+                        arg = next(inputs, None)
+                        if arg is None:
+                            break
+                        seq += 1
+                        self.start(Task(seq, self.command(arg)), devnull.fileno())
+                    if not self.running:
+                        break
+                    for task in self.wait():
+                        self.finish(task)
+            except BaseException:
+                for task in self.running.values():
+                    os.kill(task.pid, signal.SIGKILL)
+                    os.waitpid(task.pid, 0)
+                    task.out.close()
+                raise
+            finally:
+                if self.selector is not None:
+                    for key in list(self.selector.get_map().values()):
+                        os.close(key.fd)
+                    self.selector.close()
+        return self.failed
+
+    ## start a task; builtins run to completion in this process
+    def start(self, task, stdin):
+        if task.cmd.builtin:
+            out = os.fdopen(os.dup(task.out.fileno()), "wb")
+            try:
+                task.status = self.shell.__class__(stdout=out, stdin=self.shell.stdin).runcmd(task.cmd)
+            except Exception as e:
+                out.write((str(e) + "\n").encode("utf-8"))
+                task.status = 1
+            finally:
+                out.close()
+            self.finish(task)
+            return
+        try:
+            task.pid = self.shell.spawncmd(task.cmd, stdin, task.out.fileno())
+        except OSError as e:
+            task.out.write((str(e) + "\n").encode("utf-8"))
+            task.status = 127
+            self.finish(task)
+            return
+        self.running[task.pid] = task
+        if self.selector is not None:
+            self.selector.register(os.pidfd_open(task.pid), selectors.EVENT_READ, task)
+
+    ## block until at least one running task has exited and return them
+    def wait(self):
+        tasks = []
+        if self.selector is not None:
+            for key, _ in self.selector.select():
+                self.selector.unregister(key.fd)
+                os.close(key.fd)
+                tasks.append(key.data)
+                _, status = os.waitpid(key.data.pid, 0)
+                key.data.status = os.waitstatus_to_exitcode(status)
+        else:
+            while not tasks:
+                for task in self.running.values():
+                    pid, status = os.waitpid(task.pid, os.WNOHANG)
+                    if pid:
+                        task.status = os.waitstatus_to_exitcode(status)
+                        tasks.append(task)
+                if not tasks:
+                    time.sleep(0.005)
+        for task in tasks:
+            del self.running[task.pid]
+        return tasks
+
+    def finish(self, task):
+        if task.status != 0:
+            self.failed += 1
+        if self.joblog:
+            self.joblog.write("{0}\t{1:.3f}\t{2:.3f}\t{3}\t{4}\t{5}\n".format(task.seq, task.start, time.perf_counter() - task.started, max(task.status, 0), max(-task.status, 0), task.cmd))
+            self.joblog.flush()
+        if not self.keeporder:
+            self.output(task)
+            return
+        self.finished[task.seq] = task
+        while self.next in self.finished:
+            self.output(self.finished.pop(self.next))
+            self.next += 1
+
+    def output(self, task):
+        with task.out:
+            task.out.seek(0)
+            while True:
+                data = task.out.read(65536)
+                if not data:
+                    break
+                self.shell.write(data)
@@ -17,22 +17,111 @@
 ##
 ## Parsing of PySH commands.
 
+import pickle, re
+from collections import OrderedDict
+from hashlib import md5
+from os.path import expanduser, expandvars
+
 import ply.yacc as yacc
-from pysh.lexer import tokens
+from pysh.builtins import PYSH_PARSECACHE_SIZE
+from pysh.cache import cachefile
+from pysh.lexer import lexer, lextab, tokens
+from pysh.trace import tracer
+
+## a word of a command line, tagged with the token type it was lexed as
+class Word:
+    __slots__ = ("value", "kind")
+
+    def __init__(self, value, kind):
+        self.value = value
+        self.kind = kind
+
+    def __eq__(self, other):
+        return isinstance(other, Word) and (self.value, self.kind) == (other.value, other.kind)
+
+    ## the value of the word with "~" and environment variables expanded
+    ## special maps the names of special parameters such as "?" to their values
+    def expand(self, special=None):
+        if self.kind == "VAR":
+            if special and self.value[1:] in special:
+                return special[self.value[1:]]
+            return expandvars(self.value)
+        if self.kind == "PATHNAME":
+            return expanduser(self.value)
+        return self.value
+
+    def __repr__(self):
+        return "Word({0!r}, {1!r})".format(self.value, self.kind)
+
+## marks a command line that runs as a background job
+class Background:
+    __slots__ = ()
+
+    def __eq__(self, other):
+        return isinstance(other, Background)
+
+    def __repr__(self):
+        return "Background()"
+
+## redirects file descriptor fd of a command: mode is "<", ">" or ">>" with
+## a Word naming the file as target, or ">&" with a file descriptor
+class Redirect:
+    __slots__ = ("fd", "mode", "target")
+
+    def __init__(self, fd, mode, target):
+        self.fd = fd
+        self.mode = mode
+        self.target = target
+
+    def __eq__(self, other):
+        return isinstance(other, Redirect) and (self.fd, self.mode, self.target) == (other.fd, other.mode, other.target)
+
+    def __repr__(self):
+        return "Redirect({0!r}, {1!r}, {2!r})".format(self.fd, self.mode, self.target)
+
+## separates the commands of a pipeline
+class Pipe:
+    __slots__ = ()
+
+    def __eq__(self, other):
+        return isinstance(other, Pipe)
+
+    def __repr__(self):
+        return "Pipe()"
 
+## a command line parses to a flat list of nodes: the words and Redirects
+## of each command separated by Pipe markers, followed by a Background
+## marker if it ends with "&"
 def p_main(p):
-    """main : command
+    """main : pipeline
+            | pipeline JOB
             | empty
     """
+    if len(p) == 3:
+        p[1].append(Background())
     p[0] = p[1]
 
 def p_empty(p):
     """empty : """
-    p[0] = ""
+    p[0] = []
 
+def p_pipeline(p):
+    """pipeline : pipeline PIPE command
+                | command
+    """
+    if len(p) == 4:
+        p[1].append(Pipe())
+        p[1].extend(p[3])
+    p[0] = p[1]
+
+## words are appended to the list as they are reduced, so a long command
+## line is built in linear time
 def p_command(p):
-    """command : command command
-               | command JOB
+    """command : command COMMAND
+               | command HISTCMD
+               | command FILENAME
+               | command PATHNAME
+               | command VAR
                | command JOBIDENT
                | command NUMBER
                | command OPTIONS
@@ -43,9 +132,122 @@ def p_command(p):
                | PATHNAME
                | VAR
     """
-    p[0] = " ".join(p[1:])
+    if len(p) == 3:
+        p[1].append(Word(p[2], p.slice[2].type))
+        p[0] = p[1]
+    else:
+        p[0] = [Word(p[1], p.slice[1].type)]
+
+def p_command_redirect(p):
+    """command : command REDIRECT COMMAND
+               | command REDIRECT FILENAME
+               | command REDIRECT PATHNAME
+               | command REDIRECT VAR
+               | command DUPFD
+    """
+    if len(p) == 3:
+        fd, target = p[2].split(">&")
+        p[1].append(Redirect(int(fd or 1), ">&", int(target)))
+    else:
+        target = Word(p[3], p.slice[3].type)
+        if p[2].startswith("&"):
+            ## "&>" sends both stdout and stderr to the file
+            p[1].append(Redirect(1, p[2][1:], target))
+            p[1].append(Redirect(2, ">&", 1))
+        else:
+            mode = p[2].lstrip("0123456789")
+            fd = p[2][:len(p[2]) - len(mode)]
+            p[1].append(Redirect(int(fd or (0 if mode == "<" else 1)), mode, target))
+    p[0] = p[1]
 
 def p_error(p):
     print("error: encountered syntax error while parsing command")
+    lexer.errors += 1
+
+## the LALR tables are pickled into the cache directory under the grammar
+## signature, so they are only generated once per grammar and are never
+## written to the current working directory
+pinfo = yacc.ParserReflect(globals())
+pinfo.get_all()
+yacc.pickle_protocol = pickle.HIGHEST_PROTOCOL
+picklefile = cachefile("parsetab-{0}.pickle".format(pinfo.signature()))
+if picklefile:
+    parser = yacc.yacc(debug=False, optimize=True, picklefile=picklefile)
+else:
+    parser = yacc.yacc(debug=False, write_tables=False)
+
+## identifies the lexer and parser, including the node classes, for caches
+## of parsed nodes; like the lexer table name it is keyed by file contents
+with open(__file__, "rb") as f:
+    signature = "{0}-{1}".format(lextab, md5(f.read()).hexdigest())
+
+## lines made up only of plain words and paths (no "$", "~", "&", "!" or
+## comments) lex to exactly their whitespace separated words, so their argv
+## is split off directly instead of running the lexer and LALR parser
+plainline = re.compile(r"[ \t\n]*(?:(?:[A-Za-z0-9_+-]+|(?:\.{1,2})?(?:/[A-Za-z0-9._-]*)+)(?:[ \t\n]+|\Z))*")
+
+## parse a command line into its list of nodes
+def parseline(line):
+    if plainline.fullmatch(line):
+        return [Word(word, "PATHNAME" if word[0] in "./" else "COMMAND") for word in line.split()]
+    if tracer.enabled:
+        return traceparseline(line)
+    result = parser.parse(line, lexer=lexer)
+    if result is None:
+        return []
+    return result
+
+## lexing and parsing are interleaved, as the parser pulls tokens from the
+## lexer as it needs them; to time them apart the line is lexed first
+def traceparseline(line):
+    with tracer.span("lex") as span:
+        lexer.input(line)
+        tokens = list(iter(lexer.token, None))
+        span.args["tokens"] = len(tokens)
+    with tracer.span("parse"):
+        tokens = iter(tokens)
+        result = parser.parse(line, lexer=lexer, tokenfunc=lambda: next(tokens, None))
+    if result is None:
+        return []
+    return result
+
+## bounded LRU cache from raw command lines to their parsed nodes; the nodes
+## are unexpanded, so entries never go stale when the environment changes
+class ParseCache:
+    def __init__(self, size):
+        self.size = size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def parse(self, line):
+        try:
+            nodes = self.entries[line]
+        except KeyError:
+            pass
+        else:
+            self.entries.move_to_end(line)
+            self.hits += 1
+            return nodes
+
+        self.misses += 1
+        lexer.errors = 0
+        with tracer.span("parseline"):
+            nodes = tuple(parseline(line))
+        ## lines with errors are not cached so the errors are reported every time
+        if not lexer.errors:
+            self.entries[line] = nodes
+            if len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+        return nodes
 
-parser = yacc.yacc()
+parsecache = ParseCache(PYSH_PARSECACHE_SIZE)
+parse = parsecache.parse
@@ -0,0 +1,139 @@
+#!/usr/bin/python3
+## Copyright 2015 Kevin Boxhoorn
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##   http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+## registry.py
+##
+## Table of builtin commands. Builtins register themselves with the builtin
+## decorator; plugins are found through the "pysh.builtins" entry point group
+## and the plugins directory, and are only imported when first run.
+
+import os, pickle, sys
+from importlib import import_module
+from importlib.util import module_from_spec, spec_from_file_location
+from os.path import isabs, join
+
+from pysh.builtins import PYSH_PLUGINDIR
+from pysh.cache import cachefile
+
+## maps builtin names to functions called with the shell and the command.
+## Plugins are indexed by name without being imported; the index is kept in
+## the cache directory and only rebuilt (which imports importlib.metadata)
+## when an entry of sys.path or the plugins directory has been modified
+class BuiltinRegistry:
+    def __init__(self):
+        self.table = {}
+        self.plugins = None
+
+    def __contains__(self, name):
+        if name in self.table:
+            return True
+        if self.plugins is None:
+            self.loadplugins()
+        return name in self.plugins
+
+    ## names of the registered and plugin builtins, for completion
+    def names(self):
+        if self.plugins is None:
+            self.loadplugins()
+        return self.table.keys() | self.plugins.keys()
+
+    ## decorator registering func(shell, cmd) as the builtin name
+    def builtin(self, name):
+        def register(func):
+            self.table[name] = func
+            return func
+        return register
+
+    ## the function of a builtin, importing its plugin if needed, or None
+    def lookup(self, name):
+        try:
+            return self.table[name]
+        except KeyError:
+            pass
+        if self.plugins is None:
+            self.loadplugins()
+        if name not in self.plugins:
+            return None
+        kind, target = self.plugins.pop(name)
+        if kind == "file":
+            spec = spec_from_file_location("pysh_plugin_" + name, target)
+            module = module_from_spec(spec)
+            spec.loader.exec_module(module)
+        else:
+            modname, _, attr = target.partition(":")
+            obj = import_module(modname.strip())
+            for part in attr.strip().split(".") if attr else ():
+                obj = getattr(obj, part)
+            if attr:
+                self.table[name] = obj
+        if name not in self.table:
+            raise ImportError("plugin {0} does not provide builtin \"{1}\"".format(target, name))
+        return self.table[name]
+
+    ## the modification times the plugin index depends on
+    def pluginkey(self):
+        key = []
+        for path in [p for p in sys.path if isabs(p)] + [PYSH_PLUGINDIR]:
+            try:
+                key.append((path, os.stat(path).st_mtime_ns))
+            except OSError:
+                key.append((path, None))
+        return key
+
+    def loadplugins(self):
+        key = self.pluginkey()
+        cache = cachefile("plugins.pickle")
+        if cache:
+            try:
+                with open(cache, "rb") as f:
+                    cachedkey, plugins = pickle.load(f)
+                if cachedkey == key:
+                    self.plugins = plugins
+                    return
+            except (OSError, EOFError, ValueError, pickle.UnpicklingError):
+                pass
+        self.plugins = self.findplugins()
+        if cache:
+            tmpfile = "{0}.{1}.tmp".format(cache, os.getpid())
+            try:
+                with open(tmpfile, "wb") as f:
+                    pickle.dump((key, self.plugins), f, pickle.HIGHEST_PROTOCOL)
+                os.replace(tmpfile, cache)
+            except OSError:
+                pass
+
+    ## index the plugins by builtin name; files in the plugins directory take
+    ## precedence over entry points
+    def findplugins(self):
+        from importlib.metadata import entry_points
+        plugins = {}
+        eps = entry_points()
+        if hasattr(eps, "select"):
+            eps = eps.select(group="pysh.builtins")
+        else:
+            eps = eps.get("pysh.builtins", ())
+        for ep in eps:
+            plugins[ep.name] = ("entrypoint", ep.value)
+        try:
+            names = os.listdir(PYSH_PLUGINDIR)
+        except OSError:
+            names = []
+        for name in names:
+            if name.endswith(".py"):
+                plugins[name[:-3]] = ("file", join(PYSH_PLUGINDIR, name))
+        return plugins
+
+registry = BuiltinRegistry()
+builtin = registry.builtin
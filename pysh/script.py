@@ -0,0 +1,153 @@
+#!/usr/bin/python3
+## Copyright 2015 Kevin Boxhoorn
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##   http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+## script.py
+##
+## Reading script files. The parsed nodes of a script are stored in the cache
+## directory, keyed by its modification time, size and the parser signature,
+## so running it again unchanged skips lexing and parsing.
+
+import os, pickle
+from hashlib import md5
+from itertools import islice
+from os.path import abspath
+
+from pysh.cache import cachefile
+from pysh.parser import lexer, parse, signature
+
+## lines of parsed nodes pickled together, so the cache is written and read
+## back in batches rather than loaded whole
+BATCH = 1024
+
+## yield the parsed nodes of each line of the script at path as it is read
+def readscript(path):
+    with open(path, encoding="utf-8", errors="replace") as script:
+        stat = os.fstat(script.fileno())
+        key = (signature, stat.st_mtime_ns, stat.st_size)
+        cache = cachefile("script-{0}.pyshc".format(md5(abspath(path).encode("utf-8")).hexdigest()))
+        compiled = opencache(cache, key)
+        if compiled is None:
+            yield from parsescript(script, key, cache)
+            return
+    with compiled:
+        parsed = yield from loadscript(compiled)
+    ## the cache only holds the lines up to where an earlier run stopped
+    if parsed is not None:
+        with open(path, encoding="utf-8", errors="replace") as script:
+            yield from parsescript(islice(script, parsed, None), key, None)
+
+## open the cache file and read its key, returning None if it is missing or
+## out of date
+def opencache(cache, key):
+    if cache is None:
+        return None
+    try:
+        compiled = open(cache, "rb")
+    except OSError:
+        return None
+    try:
+        if pickle.load(compiled) == key:
+            return compiled
+    except (EOFError, pickle.UnpicklingError):
+        pass
+    compiled.close()
+    return None
+
+## yield the cached nodes, returning the number of lines they came from if
+## the cache is partial, or None if it holds the whole script
+def loadscript(compiled):
+    while True:
+        try:
+            batch = pickle.load(compiled)
+        except EOFError:
+            return None
+        if isinstance(batch, int):
+            return batch
+        yield from batch
+
+## parse the script line by line, writing the nodes to the cache file if
+## given; the cache is only kept if every line parsed without errors and the
+## script did not change while it was read. If the script stops early (e.g.
+## at "exit") parsing stops too, and the cache holds the lines read so far
+## followed by their count, which marks it as partial
+def parsescript(script, key, cache):
+    writer = CacheWriter(cache, key) if cache is not None else None
+    batch = []
+    errors = 0
+    lines = 0
+    for line in script:
+        lines += 1
+        lexer.errors = 0
+        nodes = parse(line)
+        errors += lexer.errors
+        if nodes:
+            batch.append(nodes)
+            try:
+                yield nodes
+            except GeneratorExit:
+                if writer is not None:
+                    writer.write(batch)
+                    writer.write(lines)
+                    closecache(writer, script, key, errors)
+                raise
+        if len(batch) >= BATCH:
+            if writer is not None:
+                writer.write(batch)
+            batch = []
+    if writer is not None:
+        writer.write(batch)
+        closecache(writer, script, key, errors)
+
+def closecache(writer, script, key, errors):
+    stat = os.fstat(script.fileno())
+    writer.close(not errors and key == (signature, stat.st_mtime_ns, stat.st_size))
+
+## writes a cache file under a temporary name, renamed into place once it is
+## complete; if writing fails the cache is given up on rather than the script
+class CacheWriter:
+    def __init__(self, cache, key):
+        self.cache = cache
+        self.tmpfile = "{0}.{1}.tmp".format(cache, os.getpid())
+        self.out = None
+        try:
+            self.out = open(self.tmpfile, "wb")
+            self.write(key)
+        except OSError:
+            pass
+
+    def write(self, obj):
+        if self.out is None:
+            return
+        try:
+            pickle.dump(obj, self.out, pickle.HIGHEST_PROTOCOL)
+        except OSError:
+            self.close(False)
+
+    def close(self, keep):
+        if self.out is None:
+            return
+        self.out.close()
+        self.out = None
+        try:
+            if keep:
+                os.replace(self.tmpfile, self.cache)
+            else:
+                os.unlink(self.tmpfile)
+        except OSError:
+            pass
+
+    ## a script abandoned while being parsed leaves no cache behind
+    def __del__(self):
+        self.close(False)
@@ -0,0 +1,118 @@
+#!/usr/bin/python3
+## Copyright 2015 Kevin Boxhoorn
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##   http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+## server.py
+##
+## Warm server for "-c" invocations. The server imports pysh and builds the
+## lexer and parser once, then forks a child for every client connection.
+## The client (see client.py) passes its stdin, stdout and stderr over the
+## socket with SCM_RIGHTS, so the child runs the command directly on them.
+
+import os, signal, socket, struct, sys
+
+from pysh.builtins import *
+from pysh.client import MESSAGE_PID, MESSAGE_STATUS
+from pysh.core import Shell
+
+## reads exactly size bytes from a socket
+def recvall(conn, size):
+    data = b""
+    while len(data) < size:
+        chunk = conn.recv(size - len(data))
+        if not chunk:
+            raise EOFError("connection closed by client")
+        data += chunk
+    return data
+
+## decodes a request into its working directory, arguments and environment
+def decoderequest(data):
+    fields = data.decode("utf-8", "surrogateescape").split("\0")
+    cwd = fields[0]
+    argc = int(fields[1])
+    argv = fields[2:2 + argc]
+    env = dict(x.split("=", 1) for x in fields[2 + argc:] if "=" in x)
+    return cwd, argv, env
+
+## runs a single request in a forked child, returning its exit status
+def handle(conn):
+    header, fds, _, _ = socket.recv_fds(conn, 4, 3)
+    if len(fds) != 3:
+        raise ArgumentError("expected stdin, stdout and stderr from client", 0)
+    cwd, argv, env = decoderequest(recvall(conn, struct.unpack("!I", header)[0]))
+
+    for target, fd in enumerate(fds):
+        os.dup2(fd, target)
+        os.close(fd)
+    os.chdir(cwd)
+    os.environ.clear()
+    os.environ.update(env)
+    conn.sendall(MESSAGE_PID + struct.pack("!i", os.getpid()))
+
+    if len(argv) != 2 or argv[0] != "-c":
+        raise ArgumentError("server only runs \"-c COMMAND\" invocations", 0)
+    shell = Shell()
+    try:
+        shell.runcmd(shell.parse(argv[1]))
+        shell.end(0, exception=False)
+    except ShellEndedError:
+        pass
+    except Exception as e:
+        shell.print(str(e) + "\n")
+    return shell.status
+
+def serve(path):
+    if os.path.exists(path):
+        os.unlink(path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    umask = os.umask(0o077)
+    try:
+        server.bind(path)
+    finally:
+        os.umask(umask)
+    server.listen(128)
+
+    ## children are reaped automatically; each child restores SIGCHLD so
+    ## that it can wait for its own commands
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    sys.stdout.flush()
+    sys.stderr.flush()
+    try:
+        while True:
+            conn, _ = server.accept()
+            uid = struct.unpack("3i", conn.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i")))[1]
+            if uid != os.getuid():
+                conn.close()
+                continue
+            if os.fork() == 0:
+                server.close()
+                signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+                signal.signal(signal.SIGINT, signal.SIG_DFL)
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                try:
+                    status = handle(conn)
+                except Exception as e:
+                    sys.stderr.write(str(e) + "\n")
+                    status = 1
+                sys.stdout.flush()
+                sys.stderr.flush()
+                try:
+                    conn.sendall(MESSAGE_STATUS + struct.pack("!i", status))
+                finally:
+                    os._exit(status)
+            conn.close()
+    finally:
+        server.close()
+        os.unlink(path)
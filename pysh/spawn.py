@@ -0,0 +1,94 @@
+#!/usr/bin/python3
+## Copyright 2015 Kevin Boxhoorn
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##   http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+## spawn.py
+##
+## Process launch backend built on os.posix_spawn, which glibc implements
+## with vfork semantics, so launching a process does not get slower as the
+## shell's heap grows. subprocess is only used on platforms whose python has
+## no os.posix_spawn.
+
+import os, signal, subprocess
+
+## signals python ignores at startup that commands expect to be at default
+SIGDEF = tuple(getattr(signal, name) for name in ("SIGPIPE", "SIGXFSZ") if hasattr(signal, name))
+
+## processes started through subprocess, kept referenced until reaped
+fallbacks = {}
+
+## starts argv[0] (or path if given) and returns its pid. fds maps file
+## descriptors of the child to the descriptors of the shell they are
+## duplicated from (only 0, 1 and 2 when falling back to subprocess);
+## pgroup places the child in a process group (0 for a new group led by
+## the child)
+def spawn(argv, path=None, fds=None, env=None, pgroup=None):
+    if path is None:
+        path = argv[0]
+    if env is None:
+        env = os.environ
+    if fds is None:
+        fds = {}
+
+    if hasattr(os, "posix_spawn"):
+        ## a source that is also replaced in the child (e.g. "2>&1 >file") is
+        ## copied first, so the order the dup2 actions run in does not matter
+        copies = []
+        try:
+            actions = []
+            for target, source in fds.items():
+                if source in fds and fds[source] != source:
+                    copies.append(os.dup(source))
+                    source = copies[-1]
+                if source != target:
+                    actions.append((os.POSIX_SPAWN_DUP2, source, target))
+            kwargs = {"file_actions": actions, "setsigdef": SIGDEF}
+            if pgroup is not None:
+                kwargs["setpgroup"] = pgroup
+            return os.posix_spawn(path, argv, env, **kwargs)
+        finally:
+            for fd in copies:
+                os.close(fd)
+
+    if pgroup is not None:
+        preexec = lambda: os.setpgid(0, pgroup)
+    else:
+        preexec = None
+    popen = subprocess.Popen(argv, executable=path, env=env, preexec_fn=preexec,
+                             stdin=fds.get(0), stdout=fds.get(1), stderr=fds.get(2))
+    fallbacks[popen.pid] = popen
+    return popen.pid
+
+## the exit status of a process from its wait status as the shell reports
+## it: the exit code, or 128 plus the number of the signal that killed it
+def exitstatus(status):
+    code = os.waitstatus_to_exitcode(status)
+    return 128 - code if code < 0 else code
+
+## waits for a spawned process and returns its exit status, as exitstatus()
+## gives it. Its resource usage is appended to usage if given
+def wait(pid, usage=None):
+    try:
+        _, status, rusage = os.wait4(pid, 0)
+    except KeyboardInterrupt:
+        os.kill(pid, signal.SIGKILL)
+        os.waitpid(pid, 0)
+        fallbacks.pop(pid, None)
+        raise
+    if usage is not None:
+        usage.append(rusage)
+    popen = fallbacks.pop(pid, None)
+    if popen is not None:
+        popen.returncode = os.waitstatus_to_exitcode(status)
+    return exitstatus(status)
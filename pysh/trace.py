@@ -0,0 +1,164 @@
+#!/usr/bin/python3
+## Copyright 2015 Kevin Boxhoorn
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##   http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+## trace.py
+##
+## Tracing of the phases of each command (reading, lexing, parsing, dispatch,
+## spawning and waiting) and of background jobs, written as Chrome trace
+## events so a session can be loaded in Perfetto or chrome://tracing.
+
+import atexit, os, threading, time
+
+## a phase being timed; the event is written when it ends, with any args
+## added in the meantime
+class Span:
+    __slots__ = ("tracer", "name", "cat", "args", "start")
+
+    def __init__(self, tracer, name, cat, args):
+        self.tracer = tracer
+        self.name = name
+        self.cat = cat
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter_ns()
+        self.tracer.emit({"name": self.name, "cat": self.cat, "ph": "X", "ts": self.start / 1000,
+                          "dur": (end - self.start) / 1000, "args": self.args})
+
+## stands in for a span while tracing is off, so untraced commands only pay
+## for a call and an attribute check
+class NoSpan:
+    __slots__ = ("args",)
+
+    def __init__(self):
+        self.args = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.args.clear()
+
+nospan = NoSpan()
+
+## writes trace events to a file as a JSON array, one event per line. The
+## closing "]" is optional in the trace event format, so a trace is readable
+## even if the shell is killed. The file is appended to, so that processes
+## forked while tracing (e.g. by "--server") add their events to the same
+## trace rather than overwriting the parent's or writing its buffer twice
+class Tracer:
+    def __init__(self):
+        self.enabled = False
+        self.path = None
+        self.file = None
+        self.lock = threading.Lock()
+        ## whether this is a forked child, which leaves closing the array to
+        ## the process that started the trace
+        self.forked = False
+        os.register_at_fork(before=self.beforefork, after_in_parent=self.afterfork, after_in_child=self.afterforkchild)
+
+    ## start tracing to path, or to the last file traced to
+    def start(self, path=None):
+        import json
+        self.dumps = json.JSONEncoder(default=str).encode
+        with self.lock:
+            if path is not None and path != self.path:
+                if self.file is not None:
+                    self.file.write("\n]\n")
+                    self.file.close()
+                    self.file = None
+                self.path = path
+            if self.path is None:
+                raise ValueError("no trace file given")
+            if self.file is None:
+                with open(self.path, "w") as f:
+                    f.write("[\n")
+                    f.write(self.dumps({"name": "process_name", "ph": "M", "pid": os.getpid(), "args": {"name": "pysh"}}))
+                self.file = open(self.path, "a")
+                self.forked = False
+            self.enabled = True
+
+    def stop(self):
+        with self.lock:
+            self.enabled = False
+            if self.file is not None:
+                self.file.flush()
+
+    def close(self):
+        with self.lock:
+            self.enabled = False
+            if self.file is not None:
+                if not self.forked:
+                    self.file.write("\n]\n")
+                self.file.close()
+                self.file = None
+
+    ## the buffer is flushed before forking so the child does not inherit
+    ## events to write again. From then on the parent writes each event as
+    ## it is emitted, so its writes do not split events the child's writes
+    ## could land between
+    def beforefork(self):
+        self.lock.acquire()
+        if self.file is not None:
+            self.file.flush()
+
+    def afterfork(self):
+        if self.file is not None:
+            self.file.reconfigure(line_buffering=True)
+        self.lock.release()
+
+    ## the child writes each event as it is emitted, since it may leave with
+    ## os._exit and never flush its buffer
+    def afterforkchild(self):
+        self.lock = threading.Lock()
+        if self.file is None:
+            return
+        self.file.close()
+        self.forked = True
+        try:
+            self.file = open(self.path, "a", buffering=1)
+        except OSError:
+            self.file = None
+            self.enabled = False
+            return
+        if self.enabled:
+            self.file.write(",\n" + self.dumps({"name": "process_name", "ph": "M", "pid": os.getpid(), "args": {"name": "pysh"}}))
+
+    def span(self, name, cat="shell", **args):
+        if not self.enabled:
+            return nospan
+        return Span(self, name, cat, args)
+
+    ## begin and end a span that may overlap others, such as a job's life
+    def begin(self, name, ident, cat="job", **args):
+        if self.enabled:
+            self.emit({"name": name, "cat": cat, "ph": "b", "id": ident, "ts": time.perf_counter_ns() / 1000, "args": args})
+    def end(self, name, ident, cat="job", **args):
+        if self.enabled:
+            self.emit({"name": name, "cat": cat, "ph": "e", "id": ident, "ts": time.perf_counter_ns() / 1000, "args": args})
+
+    def emit(self, event):
+        event["pid"] = os.getpid()
+        event["tid"] = threading.get_ident()
+        with self.lock:
+            if self.enabled:
+                self.file.write(",\n" + self.dumps(event))
+
+tracer = Tracer()
+atexit.register(tracer.close)